@@ -0,0 +1,236 @@
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 3.5+
+
+"""
+Micro-benchmarks for the DHCP codec and the byteutil helpers it uses.
+
+Reports operations per second and, for one call of each benchmark, the peak
+bytes it allocated and the number of memory blocks it allocated that are
+still alive when it returns, i.e. its result. tracemalloc only sees the live
+blocks, so temporaries show up in the peak bytes but not in the count. --save records the results as the baseline, --compare fails
+when any benchmark is slower than the baseline by more than --threshold.
+Timings are the best of several runs, and each benchmark is compared by its
+speed relative to a fixed calibration loop timed right before it, so that a
+machine that is slower today does not look like a regression. A benchmark
+that still looks slower is measured again before it counts as one.
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'discovery'))
+
+import byteutil  # noqa: E402
+import discovery3  # noqa: E402
+import fixtures  # noqa: E402
+
+BASELINE = os.path.join(HERE, 'baseline.json')
+
+
+def _validate(reply):
+    def run():
+        return discovery3.validate_dhcp_resp(fixtures.REQUEST, reply, False)
+    return run
+
+
+def _parse(reply):
+    def run():
+        return discovery3.parse_dhcp_resp(reply, False)
+    return run
+
+
+def _calibration():
+    value = 0
+    for i in range(64):
+        value = (value * 31 + i) & 0xffff
+    return value
+
+
+def get_benchmarks():
+    """
+    Return (name, function) pairs; each function runs one operation and
+    returns its result.
+    """
+    mac = fixtures.MAC_ADDRESS
+    small = fixtures.SMALL
+    hexstr = small.hex()
+    benchmarks = [
+        ('build_dhcp_request',
+         lambda: discovery3.build_dhcp_request(mac, False, False)),
+    ]
+    for name, reply in fixtures.REPLIES:
+        if name != 'malformed':
+            benchmarks.append(('validate_dhcp_resp[{0}]'.format(name),
+                               _validate(reply)))
+    for name, reply in fixtures.REPLIES:
+        benchmarks.append(('parse_dhcp_resp[{0}]'.format(name),
+                           _parse(reply)))
+    benchmarks += [
+        ('byteutil.hex_dump[small]', lambda: byteutil.hex_dump(small, len(small))),
+        ('byteutil.compare_bytes[mac]',
+         lambda: byteutil.compare_bytes(fixtures.REQUEST, small, 0x1C, 6)),
+        ('byteutil.unpack_big_endian[4]',
+         lambda: byteutil.unpack_big_endian(small, 0xF2, 4)),
+        ('byteutil.hexstr_to_bytearray[small]',
+         lambda: byteutil.hexstr_to_bytearray(hexstr)),
+    ]
+    return benchmarks
+
+
+def measure(func, min_time=0.2, repeat=5):
+    """
+    Return the best operations per second over 'repeat' runs of at least
+    'min_time' seconds, the peak bytes allocated by one call and the
+    number of blocks it allocated that its result keeps alive.
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+
+    func()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        func()
+        peak = tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    return 1.0 / best, max(peak, 0), _count_blocks(func)
+
+
+def _count_blocks(func):
+    # a separate pass, taking snapshots would distort the peak above
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    tracemalloc.start()
+    try:
+        start = tracemalloc.take_snapshot().filter_traces(ignore)
+        result = func()
+        end = tracemalloc.take_snapshot().filter_traces(ignore)
+    finally:
+        tracemalloc.stop()
+    del result
+    return sum(stat.count_diff for stat in end.compare_to(start, 'lineno')
+               if stat.count_diff > 0)
+
+
+def run(benchmarks, min_time, repeat):
+    results = {}
+    print('{0:<40} {1:>14} {2:>12} {3:>8}'.format('benchmark', 'ops/sec',
+                                                  'peak bytes', 'blocks'))
+    for name, func in benchmarks:
+        calibration = measure(_calibration, min_time, repeat)[0]
+        ops, peak, blocks = measure(func, min_time, repeat)
+        results[name] = {'ops_per_sec': ops, 'peak_bytes': peak,
+                         'blocks': blocks, 'relative': ops / calibration}
+        print('{0:<40} {1:>14,.0f} {2:>12,} {3:>8,}'.format(name, ops, peak,
+                                                             blocks))
+    return results
+
+
+def compare(results, baseline, threshold, benchmarks=(), min_time=0.2,
+            repeat=5, confirm=3, noise=0.05):
+    """
+    Print the change against the baseline; returns the names of the
+    benchmarks that regressed by more than 'threshold', judged by the
+    speed relative to the calibration loop. A benchmark that looks slower is
+    measured up to 'confirm' more times, each run longer than the last, and
+    keeps its best result. Changes within 'noise' are shown as '~'.
+    """
+    functions = dict(benchmarks)
+    regressions = []
+    print()
+    print('{0:<40} {1:>10}'.format('benchmark', 'vs baseline'))
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            print('{0:<40} {1:>10}'.format(name, 'new'))
+            continue
+        expected = baseline[name]['relative']
+        relative = result['relative']
+        for attempt in range(confirm if name in functions else 0):
+            if relative / expected >= 1 - threshold:
+                break
+            # longer runs average out more of the noise
+            run_time = min_time * 2 ** (attempt + 1)
+            calibration = measure(_calibration, run_time, repeat)[0]
+            ops = measure(functions[name], run_time, repeat)[0]
+            if ops / calibration > relative:
+                result['ops_per_sec'] = ops
+                result['relative'] = relative = ops / calibration
+        ratio = relative / expected
+        flag = ''
+        if ratio < 1 - threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        if abs(ratio - 1) < noise:
+            print('{0:<40} {1:>10}{2}'.format(name, '~', flag))
+        else:
+            print('{0:<40} {1:>+9.1%}{2}'.format(name, ratio - 1, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--save', action='store_true',
+                        help='Store the results as the new baseline')
+    parser.add_argument('--compare', action='store_true',
+                        help='Fail if a benchmark regressed against the baseline')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Allowed slowdown as a fraction (default 0.2)')
+    parser.add_argument('--baseline', default=BASELINE,
+                        help='Baseline file (default benchmarks/baseline.json)')
+    parser.add_argument('--min_time', type=float, default=0.2,
+                        help='Minimum seconds per timing run')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Timing runs per benchmark, the fastest counts')
+    parser.add_argument('--confirm', type=int, default=3,
+                        help='Extra measurements of a benchmark that looks '
+                             'slower before it counts as a regression')
+    parser.add_argument('--noise', type=float, default=0.05,
+                        help='Changes below this fraction are shown as noise')
+    parser.add_argument('--filter', default='',
+                        help='Only run benchmarks whose name contains this')
+    args = parser.parse_args()
+
+    benchmarks = [(name, func) for name, func in get_benchmarks()
+                  if args.filter in name]
+    results = run(benchmarks, args.min_time, args.repeat)
+
+    if args.compare:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold, benchmarks,
+                              args.min_time, args.repeat, args.confirm,
+                              args.noise)
+        if regressions:
+            print('\n{0} benchmark(s) regressed by more than {1:.0%}'.format(
+                len(regressions), args.threshold))
+            return 1
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'results': results},
+                      f, indent=2, sort_keys=True)
+            f.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
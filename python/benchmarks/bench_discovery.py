@@ -0,0 +1,135 @@
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 3.5+
+
+"""
+End-to-end discovery latency against the stand-in DHCP server.
+
+Runs DhcpHandler discovery repeatedly against FakeDhcpServer and reports
+p50/p95/p99 latency, failures and retransmits. The client binds udp port
+68, so this needs root or a network namespace.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'discovery'))
+
+import discovery3  # noqa: E402
+import fake_dhcp_server  # noqa: E402
+import retry  # noqa: E402
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return float('nan')
+    index = max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def discover_once(handler, mode):
+    if mode == 'async':
+        discovery3.run_async(handler.discover_async())
+        return handler.endpoint
+    mac_addr = handler.osutil.get_mac_in_bytes()
+    request = discovery3.build_dhcp_request(mac_addr, False, False)
+    response = handler._send_dhcp_req(request, False)
+    if response is None:
+        raise discovery3.DhcpError("Failed to receive dhcp response.")
+    return discovery3.parse_dhcp_resp(response, False)[0]
+
+
+def run(server, args):
+    latencies = []
+    retransmits = []
+    failures = 0
+    policy = retry.DHCP_RETRY_POLICY.with_deadline(args.timeout)
+    for _ in range(args.runs):
+        handler = discovery3.DhcpHandler()
+        handler.skip_cache = True
+        handler.retry_policy = policy
+        handler.server = (args.server, 67)
+        requests_before = sum(server.requests.values()) if server else 0
+        start = time.monotonic()
+        try:
+            endpoint = discover_once(handler, args.mode)
+        except discovery3.DhcpError:
+            endpoint = None
+        elapsed = time.monotonic() - start
+        if server is not None:
+            retransmits.append(
+                sum(server.requests.values()) - requests_before - 1)
+        if endpoint is None:
+            failures += 1
+        else:
+            latencies.append(elapsed)
+    return latencies, retransmits, failures
+
+
+def report(latencies, retransmits, failures, runs):
+    latencies.sort()
+    print('runs: {0}, failures: {1}'.format(runs, failures))
+    for name, fraction in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+        print('{0}: {1:8.2f} ms'.format(name,
+                                        percentile(latencies, fraction) * 1000))
+    if retransmits:
+        print('retransmits: total {0}, max {1}, runs with retransmits {2}'.format(
+            sum(retransmits), max(retransmits),
+            sum(1 for r in retransmits if r > 0)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    fake_dhcp_server.add_server_arguments(parser)
+    parser.add_argument('--runs', type=int, default=100,
+                        help='Number of discoveries (default 100)')
+    parser.add_argument('--mode', choices=('async', 'sync'), default='async',
+                        help='Drive discover_async or the blocking path')
+    parser.add_argument('--timeout', type=float, default=5.0,
+                        help='Budget of each discovery in seconds')
+    parser.add_argument('--server',
+                        help='Where the client sends requests; defaults to '
+                             '--address, use <broadcast> in a namespace')
+    parser.add_argument('--external', action='store_true',
+                        help='Do not start the stand-in, use a running server')
+    args = parser.parse_args()
+    if args.server is None:
+        args.server = args.address
+
+    # keep results out of the real endpoint cache
+    cache_dir = tempfile.mkdtemp()
+    os.environ['SCHEDULEDEVENTSCACHE'] = os.path.join(cache_dir, 'endpoint.json')
+
+    server = None
+    if not args.external:
+        server = fake_dhcp_server.server_from_args(args).start()
+    try:
+        latencies, retransmits, failures = run(server, args)
+    finally:
+        if server is not None:
+            server.stop()
+    report(latencies, retransmits, failures, args.runs)
+    return 1 if failures == args.runs else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,140 @@
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 3.5+
+
+"""
+Load test of the poll/approve path against the stand-in metadata service.
+
+Runs --pollers ApprovalDaemon instances, one simulated VM each, in
+parallel for --seconds against FakeImdsServer and reports request
+throughput, request latency percentiles, failed polls and the time from
+an event being scheduled to its approval.
+"""
+
+import argparse
+import http.client
+import os
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'discovery'))
+
+import fake_imds_server  # noqa: E402
+import scheduled_events  # noqa: E402
+from bench_discovery import percentile  # noqa: E402
+
+
+class TimedClient(scheduled_events.ScheduledEventsClient):
+    """
+    Records the latency of every HTTP round trip, retries included.
+    """
+
+    def __init__(self, address, latencies):
+        scheduled_events.ScheduledEventsClient.__init__(self, address)
+        self.latencies = latencies
+
+    def _send(self, method, body, headers, timeout):
+        start = time.monotonic()
+        try:
+            return scheduled_events.ScheduledEventsClient._send(
+                self, method, body, headers, timeout)
+        finally:
+            self.latencies.append(time.monotonic() - start)
+
+
+def poll(address, scheduler, stop, latencies, failures):
+    client = TimedClient(address, latencies)
+    daemon = scheduled_events.ApprovalDaemon(
+        client, scheduled_events.ApprovalPolicy(), scheduler)
+    try:
+        while not stop.is_set():
+            try:
+                daemon.poll_once()
+            except (OSError, http.client.HTTPException,
+                    scheduled_events.ScheduledEventsError, ValueError):
+                failures.append(1)
+            stop.wait(scheduler.next_interval(daemon.tracker.events.values()))
+    finally:
+        client.close()
+
+
+def run(server, args):
+    scheduler = scheduled_events.PollScheduler(
+        args.idle_interval, args.active_interval, args.urgent_interval,
+        args.urgent_window)
+    stop = threading.Event()
+    latencies = []
+    failures = []
+    threads = [threading.Thread(target=poll,
+                                args=(server.address('vm{0}'.format(i)),
+                                      scheduler, stop, latencies, failures),
+                                daemon=True)
+               for i in range(args.pollers)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return latencies, len(failures), time.monotonic() - start
+
+
+def report(server, latencies, failures, elapsed):
+    latencies.sort()
+    print('requests: {0} in {1:.1f} s, {2:.1f} req/s, failed polls: {3}'.format(
+        len(latencies), elapsed, len(latencies) / elapsed, failures))
+    for name, fraction in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+        print('latency {0}: {1:8.2f} ms'.format(
+            name, percentile(latencies, fraction) * 1000))
+    delays = sorted(approved - scheduled
+                    for scheduled, approved in server.approvals())
+    print('approvals: {0}'.format(len(delays)))
+    for name, fraction in (('p50', 0.5), ('p95', 0.95), ('max', 1.0)):
+        print('time to approval {0}: {1:8.2f} s'.format(
+            name, percentile(delays, fraction)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    fake_imds_server.add_server_arguments(parser)
+    parser.add_argument('--pollers', type=int, default=50,
+                        help='Number of concurrent pollers (default 50)')
+    parser.add_argument('--seconds', type=float, default=30.0,
+                        help='Length of the run in seconds')
+    parser.add_argument('--idle_interval', type=float, default=15.0,
+                        help='Poll interval without events')
+    parser.add_argument('--active_interval', type=float, default=5.0,
+                        help='Poll interval while events are pending')
+    parser.add_argument('--urgent_interval', type=float, default=1.0,
+                        help='Poll interval close to NotBefore')
+    parser.add_argument('--urgent_window', type=float, default=60.0,
+                        help='Seconds before NotBefore that count as urgent')
+    parser.set_defaults(events_every=10.0, not_before=60.0)
+    args = parser.parse_args()
+
+    server = fake_imds_server.server_from_args(args).start()
+    try:
+        latencies, failures, elapsed = run(server, args)
+    finally:
+        server.stop()
+    report(server, latencies, failures, elapsed)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 3.7+ (-X importtime)
+
+"""
+Import-time budget check for the entry points that run at boot or in
+short-lived helpers.
+
+Each module is imported in a fresh interpreter with -X importtime. The
+check fails when the cumulative import time, the best of --runs, exceeds
+the module's budget times --scale, or when the module pulls in a package
+that only some code paths need.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DISCOVERY = os.path.join(HERE, '..', 'discovery')
+
+# module -> (budget in milliseconds, modules it must not import)
+BUDGETS = {
+    'discovery3': (70, ('asyncio', 'argparse', 'logging', 'subprocess',
+                        'uuid', 'http.client', 'urllib.request')),
+    'util': (10, ('socket', 'subprocess', 'json', 'http.client',
+                 'urllib.request', 'asyncio')),
+    'address': (10, ('asyncio', 'http.client', 'urllib.request')),
+    'byteutil': (10, ('socket', 'subprocess')),
+    'scheduled_events': (100, ('asyncio', 'logging', 'subprocess',
+                              'urllib.request', 'orjson', 'ujson')),
+}
+
+
+def import_times(module):
+    """
+    Import 'module' in a fresh interpreter. Returns the cumulative import
+    time of every module it loaded, in microseconds, by name.
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = DISCOVERY
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=env,
+        check=True)
+    times = {}
+    for line in proc.stderr.decode('utf-8', 'replace').splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        times[fields[2].strip()] = int(fields[1])
+    return times
+
+
+def check(module, budget, forbidden, runs, scale):
+    # the first import may have to write the .pyc files
+    import_times(module)
+    best = None
+    loaded = set()
+    for _ in range(runs):
+        times = import_times(module)
+        loaded.update(times)
+        cumulative = times.get(module, 0) / 1000.0
+        best = cumulative if best is None else min(best, cumulative)
+    failures = []
+    if best > budget * scale:
+        failures.append('{0:.1f} ms over the {1:.1f} ms budget'.format(
+            best, budget * scale))
+    for name in forbidden:
+        if name in loaded:
+            failures.append('imports {0}'.format(name))
+    status = 'FAIL' if failures else 'ok'
+    print('{0:<20} {1:>8.1f} ms  {2}{3}'.format(
+        module, best, status,
+        ': ' + ', '.join(failures) if failures else ''))
+    return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--runs', type=int, default=5,
+                        help='Imports per module, the fastest counts')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='Multiply every budget, for slow machines')
+    parser.add_argument('modules', nargs='*',
+                        help='Modules to check (default: all)')
+    args = parser.parse_args()
+
+    ok = True
+    for module in args.modules or sorted(BUDGETS):
+        budget, forbidden = BUDGETS[module]
+        ok = check(module, budget, forbidden, args.runs, args.scale) and ok
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
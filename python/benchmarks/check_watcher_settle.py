@@ -0,0 +1,110 @@
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 3.5+ on Linux
+
+"""
+Checks that NetworkWatcher reports a change within its settle period while
+relevant notifications keep arriving.
+
+Adds an address to the primary interface, then adds and removes a second
+address in a tight loop for --seconds. The check fails unless on_change
+runs within --settle (plus --slack) of the first address being added. Both
+addresses come from TEST-NET-2 and are removed afterwards. Changing
+addresses needs root, or a network namespace.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'discovery'))
+
+import network_watcher  # noqa: E402
+
+
+def ip_addr(action, address, interface):
+    subprocess.run(['ip', 'addr', action, address, 'dev', interface],
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def flood(address, interface, seconds):
+    """
+    Add and remove 'address' until 'seconds' have passed; returns the
+    number of notifications caused.
+    """
+    notifications = 0
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        ip_addr('add', address, interface)
+        ip_addr('del', address, interface)
+        notifications += 2
+    return notifications
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--settle', type=float, default=0.5,
+                        help='Settle period of the watcher in seconds')
+    parser.add_argument('--slack', type=float, default=0.25,
+                        help='Allowed lateness of on_change in seconds')
+    parser.add_argument('--seconds', type=float, default=3.0,
+                        help='How long the notifications keep coming')
+    parser.add_argument('--address', default='198.51.100.77/32',
+                        help='Address that stays, the change to report')
+    parser.add_argument('--flap', default='198.51.100.78/32',
+                        help='Address added and removed in a loop')
+    args = parser.parse_args()
+
+    interface = network_watcher.NetworkState.capture().name
+    if interface is None:
+        print('No primary interface (no default route)')
+        return 1
+
+    changes = []
+    watcher = network_watcher.NetworkWatcher(
+        lambda old, new: changes.append(time.monotonic()), args.settle)
+    thread = threading.Thread(target=watcher.run)
+    thread.start()
+    # let run() read the initial state
+    time.sleep(0.2)
+    try:
+        start = time.monotonic()
+        ip_addr('add', args.address, interface)
+        notifications = flood(args.flap, interface, args.seconds)
+    finally:
+        ip_addr('del', args.flap, interface)
+        ip_addr('del', args.address, interface)
+        watcher.stop()
+        thread.join(2)
+        watcher.close()
+
+    print('{0} notifications on {1} in {2:.1f}s'.format(
+        notifications + 1, interface, args.seconds))
+    if not changes:
+        print('FAIL: on_change did not run')
+        return 1
+    latency = changes[0] - start
+    ok = latency <= args.settle + args.slack
+    print('{0}: on_change after {1:.3f}s, settle {2:.3f}s'.format(
+        'ok' if ok else 'FAIL', latency, args.settle))
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
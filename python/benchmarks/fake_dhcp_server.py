@@ -0,0 +1,237 @@
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 3.5+
+
+"""
+Stand-in DHCP server answering DHCPDISCOVER the way the Azure one does.
+
+It listens on udp port 67 of one address (loopback by default, or any
+address inside a network namespace) and answers with a DHCPOFFER carrying
+options 245, 3, 249 and 51 as configured. Replies can be delayed, dropped
+at random and preceded by noise: offers with a foreign transaction id, as
+seen on a busy subnet.
+"""
+
+import argparse
+import os
+import random
+import select
+import socket
+import struct
+import threading
+import time
+
+MAGIC_COOKIE = b'\x63\x82\x53\x63'
+
+
+def _ip(address):
+    return socket.inet_aton(address)
+
+
+def _option(code, value):
+    return struct.pack('!BB', code, len(value)) + value
+
+
+def encode_routes(routes):
+    """
+    Encode (prefix, gateway) pairs such as ('10.1.0.0/16', '10.0.0.1') as an
+    option 249 value.
+    """
+    value = b''
+    for prefix, gateway in routes:
+        net, prefix_len = prefix.split('/')
+        prefix_len = int(prefix_len)
+        value += bytes([prefix_len]) + _ip(net)[:(prefix_len + 7) // 8] + \
+            _ip(gateway)
+    return value
+
+
+class FakeDhcpServer(object):
+    """
+    endpoint, gateway: IP addresses returned in options 245 and 3; None
+                       leaves the option out.
+    routes: (prefix, gateway) pairs returned in option 249.
+    lease_time: seconds returned in option 51.
+    delay, jitter: seconds to wait before replying, plus up to 'jitter' more.
+    drop_rate: fraction of requests that get no reply.
+    noise: replies with a foreign transaction id sent before the real one.
+    broadcast: reply to 255.255.255.255 instead of the sender's address.
+    """
+
+    def __init__(self, address='127.0.0.1', port=67,
+                 endpoint='168.63.129.16', gateway='10.0.0.1', routes=(),
+                 lease_time=3600, delay=0.0, jitter=0.0, drop_rate=0.0,
+                 noise=0, broadcast=False, seed=None):
+        self.address = address
+        self.port = port
+        self.endpoint = endpoint
+        self.gateway = gateway
+        self.routes = list(routes)
+        self.lease_time = lease_time
+        self.delay = delay
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.noise = noise
+        self.broadcast = broadcast
+        self.random = random.Random(seed)
+        # transaction id -> number of requests received
+        self.requests = {}
+        self.replies = 0
+        self._sock = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def options(self):
+        options = [_option(53, b'\x02'),
+                   _option(54, _ip('168.63.129.16')),
+                   _option(51, struct.pack('!I', self.lease_time)),
+                   _option(1, _ip('255.255.255.0'))]
+        if self.gateway is not None:
+            options.append(_option(3, _ip(self.gateway)))
+        if self.routes:
+            options.append(_option(249, encode_routes(self.routes)))
+        if self.endpoint is not None:
+            options.append(_option(245, _ip(self.endpoint)))
+        return b''.join(options) + b'\xff'
+
+    def build_reply(self, request, xid=None):
+        reply = bytearray(request[:0xF0])
+        reply[0] = 2  # BOOTREPLY
+        if xid is not None:
+            reply[4:8] = xid
+        reply[0x10:0x14] = _ip('10.0.0.4')  # yiaddr
+        reply[0xEC:0xF0] = MAGIC_COOKIE
+        return bytes(reply) + self.options()
+
+    def start(self):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self._sock.bind((self.address, self.port))
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def _serve(self):
+        while not self._stop.is_set():
+            readable, _, _ = select.select([self._sock], [], [], 0.1)
+            if not readable:
+                continue
+            request, addr = self._sock.recvfrom(2048)
+            if len(request) < 0xF0 or request[0] != 1:
+                continue
+            xid = bytes(request[4:8])
+            with self._lock:
+                self.requests[xid] = self.requests.get(xid, 0) + 1
+            if self.random.random() < self.drop_rate:
+                continue
+            threading.Thread(target=self._reply, args=(request, addr),
+                             daemon=True).start()
+
+    def _reply(self, request, addr):
+        delay = self.delay + self.random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if self.broadcast:
+            addr = ('<broadcast>', 68)
+        try:
+            for _ in range(self.noise):
+                self._sock.sendto(self.build_reply(request, os.urandom(4)),
+                                  addr)
+            self._sock.sendto(self.build_reply(request), addr)
+        except (OSError, AttributeError):
+            # stopped while replying
+            return
+        with self._lock:
+            self.replies += 1
+
+
+def parse_routes(value):
+    """
+    Parse 'prefix:gateway,...' as used on the command line.
+    """
+    if not value:
+        return []
+    return [tuple(item.split(':')) for item in value.split(',')]
+
+
+def add_server_arguments(parser):
+    parser.add_argument('--address', default='127.0.0.1',
+                        help='Address to listen on (default 127.0.0.1)')
+    parser.add_argument('--endpoint', default='168.63.129.16',
+                        help='Option 245 scheduled events endpoint')
+    parser.add_argument('--gateway', default='10.0.0.1',
+                        help='Option 3 default gateway')
+    parser.add_argument('--routes', default='',
+                        help='Option 249 routes as prefix:gateway,...')
+    parser.add_argument('--lease_time', type=int, default=3600,
+                        help='Option 51 lease time in seconds')
+    parser.add_argument('--delay', type=float, default=0.0,
+                        help='Seconds to wait before replying')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='Random extra delay of up to this many seconds')
+    parser.add_argument('--drop_rate', type=float, default=0.0,
+                        help='Fraction of requests left unanswered')
+    parser.add_argument('--noise', type=int, default=0,
+                        help='Foreign transaction id replies sent before each reply')
+    parser.add_argument('--broadcast', action='store_true',
+                        help='Reply to 255.255.255.255 instead of the sender')
+
+
+def server_from_args(args):
+    return FakeDhcpServer(args.address, 67, args.endpoint, args.gateway,
+                          parse_routes(args.routes), args.lease_time,
+                          args.delay, args.jitter, args.drop_rate,
+                          args.noise, args.broadcast)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    server = server_from_args(args).start()
+    print('Answering DHCPDISCOVER on {0}:67, Ctrl + C to stop'.format(
+        args.address))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+    print('{0} requests, {1} replies'.format(
+        sum(server.requests.values()), server.replies))
+
+
+if __name__ == '__main__':
+    main()
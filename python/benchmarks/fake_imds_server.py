@@ -0,0 +1,312 @@
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 3.5+
+
+"""
+Stand-in for the Scheduled Events endpoint of the metadata service.
+
+Every virtual machine, selected by an optional path prefix such as
+/vm7/metadata/scheduledevents, follows its own scripted timeline: an event
+is scheduled every --events_every seconds with NotBefore --not_before
+seconds ahead, starts when approved or when NotBefore passes, and
+disappears --duration seconds later. Each change increments the
+DocumentIncarnation. POSTed StartRequests are checked against the current
+incarnation. Latency, 429 and 5xx responses can be injected.
+"""
+
+import argparse
+import email.utils
+import http.server
+import json
+import random
+import socketserver
+import threading
+import time
+import uuid
+
+PATH = '/metadata/scheduledevents'
+
+
+class Timeline(object):
+    """
+    Scripted events of one virtual machine.
+    """
+
+    def __init__(self, events_every, not_before, duration, event_type,
+                 resource, offset=0.0, clock=time.time):
+        self.events_every = events_every
+        self.not_before = not_before
+        self.duration = duration
+        self.event_type = event_type
+        self.resource = resource
+        self.clock = clock
+        self.incarnation = 1
+        self.events = {}
+        self.next_event = clock() + offset
+        # EventId -> (scheduled at, approved at)
+        self.approvals = {}
+        self.lock = threading.Lock()
+
+    def _advance(self, now):
+        changed = False
+        if self.events_every and now >= self.next_event:
+            event_id = str(uuid.uuid4()).upper()
+            self.events[event_id] = {
+                'EventId': event_id,
+                'EventType': self.event_type,
+                'ResourceType': 'VirtualMachine',
+                'Resources': [self.resource],
+                'EventStatus': 'Scheduled',
+                'NotBefore': email.utils.formatdate(now + self.not_before,
+                                                    usegmt=True),
+                '_scheduled': now,
+                '_not_before': now + self.not_before,
+            }
+            self.next_event = now + self.events_every
+            changed = True
+        for event_id, event in list(self.events.items()):
+            if event['EventStatus'] == 'Scheduled' and \
+                    now >= event['_not_before']:
+                self._start(event, now)
+                changed = True
+            elif event['EventStatus'] == 'Started' and \
+                    now >= event['_started'] + self.duration:
+                del self.events[event_id]
+                changed = True
+        if changed:
+            self.incarnation += 1
+
+    def _start(self, event, now):
+        event['EventStatus'] = 'Started'
+        event['NotBefore'] = ''
+        event['_started'] = now
+
+    def document(self):
+        with self.lock:
+            self._advance(self.clock())
+            return {
+                'DocumentIncarnation': self.incarnation,
+                'Events': [dict((k, v) for k, v in e.items()
+                                if not k.startswith('_'))
+                           for e in self.events.values()],
+            }
+
+    def approve(self, body):
+        """
+        Apply StartRequests. Returns an HTTP status code.
+        """
+        with self.lock:
+            now = self.clock()
+            self._advance(now)
+            if body.get('DocumentIncarnation') != self.incarnation:
+                return 409
+            started = False
+            for request in body.get('StartRequests', []):
+                event = self.events.get(request.get('EventId'))
+                if event is None:
+                    return 400
+                if event['EventStatus'] == 'Scheduled':
+                    self.approvals[event['EventId']] = (event['_scheduled'],
+                                                        now)
+                    self._start(event, now)
+                    started = True
+            if started:
+                self.incarnation += 1
+            return 200
+
+
+class FakeImdsServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """
+    latency, jitter: seconds added to every response, plus up to 'jitter'.
+    throttle_rate: fraction of requests answered with 429.
+    error_rate: fraction of requests answered with 500.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('127.0.0.1', 0), events_every=30.0,
+                 not_before=300.0, duration=10.0, event_type='Reboot',
+                 latency=0.0, jitter=0.0, throttle_rate=0.0, error_rate=0.0,
+                 seed=None):
+        http.server.HTTPServer.__init__(self, address, FakeImdsHandler)
+        self.events_every = events_every
+        self.not_before = not_before
+        self.duration = duration
+        self.event_type = event_type
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.timelines = {}
+        self.requests = 0
+        self.lock = threading.Lock()
+        self._thread = None
+
+    def timeline(self, vm):
+        with self.lock:
+            timeline = self.timelines.get(vm)
+            if timeline is None:
+                offset = self.random.uniform(0, self.events_every or 0)
+                timeline = Timeline(self.events_every, self.not_before,
+                                    self.duration, self.event_type,
+                                    vm or '_sample_vm', offset)
+                self.timelines[vm] = timeline
+            return timeline
+
+    def draw(self):
+        """
+        Count a request and return the delay and injected status, if any.
+        """
+        with self.lock:
+            self.requests += 1
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            roll = self.random.random()
+        if roll < self.throttle_rate:
+            return delay, 429
+        if roll < self.throttle_rate + self.error_rate:
+            return delay, 500
+        return delay, None
+
+    def approvals(self):
+        """
+        Return the (scheduled at, approved at) pairs of all approvals.
+        """
+        result = []
+        for timeline in list(self.timelines.values()):
+            with timeline.lock:
+                result.extend(timeline.approvals.values())
+        return result
+
+    def address(self, vm=None):
+        host, port = self.server_address[:2]
+        prefix = '/' + vm if vm else ''
+        return 'http://{0}:{1}{2}{3}?api-version=2017-08-01'.format(
+            host, port, prefix, PATH)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+class FakeImdsHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _vm(self):
+        path = self.path.split('?', 1)[0]
+        if not path.endswith(PATH):
+            return None
+        return path[:-len(PATH)].strip('/')
+
+    def _respond(self, status, body=b''):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _begin(self):
+        vm = self._vm()
+        if vm is None:
+            self._respond(404)
+            return None
+        if self.headers.get('Metadata', '').lower() != 'true':
+            self._respond(400)
+            return None
+        delay, status = self.server.draw()
+        if delay > 0:
+            time.sleep(delay)
+        if status is not None:
+            self._respond(status)
+            return None
+        return self.server.timeline(vm)
+
+    def do_GET(self):
+        timeline = self._begin()
+        if timeline is not None:
+            self._respond(200, json.dumps(timeline.document()).encode('utf-8'))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        timeline = self._begin()
+        if timeline is None:
+            return
+        try:
+            request = json.loads(body.decode('utf-8'))
+        except ValueError:
+            self._respond(400)
+            return
+        self._respond(timeline.approve(request))
+
+
+def add_server_arguments(parser):
+    parser.add_argument('--port', type=int, default=0,
+                        help='Port to listen on (default: any free port)')
+    parser.add_argument('--events_every', type=float, default=30.0,
+                        help='Seconds between scheduled events per VM (0: none)')
+    parser.add_argument('--not_before', type=float, default=300.0,
+                        help='Seconds from scheduling to NotBefore')
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help='Seconds a started event stays in the document')
+    parser.add_argument('--event_type', default='Reboot',
+                        help='EventType of the scheduled events')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='Random extra latency of up to this many seconds')
+    parser.add_argument('--throttle_rate', type=float, default=0.0,
+                        help='Fraction of requests answered with 429')
+    parser.add_argument('--error_rate', type=float, default=0.0,
+                        help='Fraction of requests answered with 500')
+
+
+def server_from_args(args):
+    return FakeImdsServer(('127.0.0.1', args.port), args.events_every,
+                          args.not_before, args.duration, args.event_type,
+                          args.latency, args.jitter, args.throttle_rate,
+                          args.error_rate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    server = server_from_args(args).start()
+    print('Serving scheduled events at {0}, Ctrl + C to stop'.format(
+        server.address()))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
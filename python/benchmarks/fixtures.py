@@ -0,0 +1,114 @@
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 3.5+
+
+"""
+Corpus of DHCP replies used by the benchmarks.
+
+Every reply answers REQUEST, a DHCPDISCOVER with a fixed MAC address and
+transaction id, so validate_dhcp_resp accepts the well formed ones.
+"""
+
+import struct
+
+import discovery3
+
+MAC_ADDRESS = bytearray.fromhex('000d3a1b2c3d')
+TRANSACTION_ID = b'\x5e\xc0\x1d\x42'
+
+REQUEST = bytearray(discovery3.DHCP_REQUEST_TEMPLATE)
+discovery3.patch_dhcp_request(REQUEST, MAC_ADDRESS, False, TRANSACTION_ID)
+
+
+def option(code, value):
+    return struct.pack('!BB', code, len(value)) + value
+
+
+def ip(address):
+    return bytes(int(part) for part in address.split('.'))
+
+
+def route(prefix_len, net, gateway):
+    """
+    Encode one option 249 classless static route.
+    """
+    significant = (prefix_len + 7) // 8
+    return bytes([prefix_len]) + ip(net)[:significant] + ip(gateway)
+
+
+def reply(options, end=True):
+    """
+    Build a DHCPOFFER answering REQUEST that carries 'options'.
+    """
+    header = bytearray(REQUEST[:0xF0])
+    header[0] = 2  # BOOTREPLY
+    header[0x10:0x14] = ip('10.0.0.4')  # yiaddr
+    body = b''.join(options)
+    if end:
+        body += b'\xff'
+    return bytes(header) + body
+
+
+COMMON_OPTIONS = [
+    option(53, b'\x02'),                         # DHCPOFFER
+    option(54, ip('168.63.129.16')),             # server identifier
+    option(51, struct.pack('!I', 0xFFFFFFFF)),   # lease time
+    option(1, ip('255.255.255.0')),              # subnet mask
+    option(3, ip('10.0.0.1')),                   # router
+    option(245, ip('168.63.129.16')),            # scheduled events endpoint
+]
+
+# What a typical Azure VM receives.
+SMALL = reply(COMMON_OPTIONS)
+
+# Many options in front of the ones discovery needs: DNS servers, domain
+# name and search list, NTP servers, renewal times and vendor options.
+OPTION_HEAVY = reply([
+    option(53, b'\x02'),
+    option(54, ip('168.63.129.16')),
+    option(51, struct.pack('!I', 86400)),
+    option(58, struct.pack('!I', 43200)),
+    option(59, struct.pack('!I', 75600)),
+    option(1, ip('255.255.240.0')),
+    option(28, ip('10.0.15.255')),
+    option(6, ip('168.63.129.16') * 4),
+    option(15, b'reddog.microsoft.com'),
+    option(119, b'\x06reddog\x09microsoft\x03com\x00' * 4),
+    option(42, ip('10.0.0.10') + ip('10.0.0.11')),
+    option(26, struct.pack('!H', 1500)),
+    option(43, bytes(range(64))),
+    option(60, b'MSFT 5.0'),
+    option(3, ip('10.0.0.1')),
+    option(245, ip('168.63.129.16')),
+] + [option(224 + i, bytes(12)) for i in range(16)])
+
+# Option 249 close to its 255 byte limit.
+MANY_ROUTES = reply(COMMON_OPTIONS + [
+    option(249, b''.join(route(24, '10.{0}.{1}.0'.format(i // 8, i % 8),
+                               '10.0.0.1') for i in range(31)))
+])
+
+# Truncated in the middle of option 249 and without an end option.
+MALFORMED = reply(COMMON_OPTIONS + [
+    option(249, b''.join(route(16, '172.16.0.0', '10.0.0.1')
+                         for _ in range(8)))[:-9]
+], end=False)
+
+REPLIES = [
+    ('small', SMALL),
+    ('option_heavy', OPTION_HEAVY),
+    ('many_routes', MANY_ROUTES),
+    ('malformed', MALFORMED),
+]
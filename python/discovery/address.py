@@ -0,0 +1,87 @@
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 3.5+
+
+"""
+Finding and checking the address of the Scheduled Events endpoint.
+"""
+
+import os
+import sys
+
+
+def get_address(arg_ip_address, use_registry, headers, use_dhcp=False):
+    '''
+    Gets the address of the Scheduled Events endpoint.
+    An IP address given as argument is checked first, then the cached
+    discovery result is used; the remaining sources are tried concurrently,
+    see endpoint_resolver. Exits if no IP address is valid.
+    '''
+    import endpoint_resolver
+
+    ip_address = endpoint_resolver.resolve_endpoint(
+        arg_ip_address, use_registry, headers, use_dhcp)
+    if ip_address is None:
+        print("Could not find a valid IP address. Please create your VM within a VNET " +
+              "or run discovery.py first")
+        exit(1)
+    return make_address(ip_address)
+
+SCHEDULED_EVENTS_PATH = '/metadata/scheduledevents?api-version=2017-03-01'
+
+def make_address(ip_address):
+    '''
+    Returns the address for scheduled event endpoint from the IP address provided.
+    '''
+    return 'http://' + ip_address + SCHEDULED_EVENTS_PATH
+
+def check_ip_address(address, headers):
+    '''
+    Checks whether the address of the scheduled event endpoint is valid.
+    '''
+    import http.client
+    import retry
+    import scheduled_events
+
+    client = scheduled_events.ScheduledEventsClient(
+        address, headers, retry.PROBE_RETRY_POLICY)
+    try:
+        return 'Events' in client.get_document()
+    except (OSError, http.client.HTTPException,
+            scheduled_events.ScheduledEventsError, ValueError):
+        return False
+    finally:
+        client.close()
+
+def get_ip_address_reg_env(use_registry):
+    '''
+    Get the IP address of scheduled event from registry or environment.
+    Returns None if IP address is not provided or stored.
+    '''
+    ip_address = None
+    if use_registry and sys.platform == 'win32':
+        import winreg as wreg
+        # use ScheduledEventsIp in registry if available.
+        try:
+            key = wreg.OpenKey(wreg.HKEY_LOCAL_MACHINE, "Software\\ScheduledEvents")
+            ip_address = wreg.QueryValueEx(key, 'ScheduledEventsIp')[0]
+            key.Close()
+        except FileNotFoundError:
+            pass
+    elif sys.platform == 'win32' or "linux" in sys.platform:
+        # use SCHEDULEDEVENTSIP in system variables if available.
+        ip_address = os.getenv('SCHEDULEDEVENTSIP')
+
+    return ip_address
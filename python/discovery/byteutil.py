@@ -0,0 +1,122 @@
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 3.5+
+
+"""
+Byte and hex helpers for parsing DHCP packets.
+"""
+
+import struct
+
+def unpack(buf, offset, range):
+    """
+    Unpack bytes into python values.
+    """
+    result = 0
+    for i in range:
+        result = (result << 8) | str_to_ord(buf[offset + i])
+    return result
+        
+def unpack_big_endian(buf, offset, length):
+    """
+    Unpack big endian bytes into python values.
+    """
+    return unpack(buf, offset, list(range(0, length)))
+
+def hex_dump3(buf, offset, length):
+    """
+    Dump range of buf in formatted hex.
+    """
+    return ''.join(['%02X' % str_to_ord(char) for char in buf[offset:offset + length]])
+
+def hex_dump2(buf):
+    """
+    Dump buf in formatted hex.
+    """
+    return hex_dump3(buf, 0, len(buf))
+
+def iter_hex_dump(buffer, size=-1):
+    """
+    Yield the lines of the hex dump of 'buffer' of 'size' one at a time.
+    """
+    if size < 0:
+        size = len(buffer)
+    for start in range(0, size, 16):
+        row = [str_to_ord(buffer[i]) for i in range(start, min(start + 16, size))]
+        cells = ['%02X ' % byte for byte in row] + ['   '] * (16 - len(row))
+        text = ''.join(chr(byte) if is_printable(byte) else '.' for byte in row)
+        yield '%06X: %s %s %s' % (start, ''.join(cells[:8]),
+                                  ''.join(cells[8:]), text)
+
+def write_hex_dump(stream, buffer, size=-1):
+    """
+    Write the hex dump of 'buffer' of 'size' to 'stream' line by line.
+    """
+    for line in iter_hex_dump(buffer, size):
+        stream.write(line + '\n')
+
+def hex_dump(buffer, size):
+    """
+    Return Hex formated dump of a 'buffer' of 'size'.
+    """
+    return '\n'.join(iter_hex_dump(buffer, size))
+
+def str_to_ord(a):
+    """
+    Allows indexing into a string or an array of integers transparently.
+    Generic utility function.
+    """
+    if type(a) == type(b'') or type(a) == type(u''):
+        a = ord(a)
+    return a
+
+def compare_bytes(a, b, start, length):
+    for offset in range(start, start + length):
+        if str_to_ord(a[offset]) != str_to_ord(b[offset]):
+            return False
+    return True
+
+def int_to_ip4_addr(a):
+    """
+    Build DHCP request string.
+    """
+    return "%u.%u.%u.%u" % ((a >> 24) & 0xFF,
+                            (a >> 16) & 0xFF,
+                            (a >> 8) & 0xFF,
+                            (a) & 0xFF)
+
+
+def hexstr_to_bytearray(a):
+    """
+    Return hex string packed into a binary struct.
+    """
+    b = b""
+    for c in range(0, len(a) // 2):
+        b += struct.pack("B", int(a[c * 2:c * 2 + 2], 16))
+    return b
+
+def is_printable(ch):
+    """
+    Return True if character is displayable.
+    """
+    return (is_in_range(ch, str_to_ord('A'), str_to_ord('Z'))
+            or is_in_range(ch, str_to_ord('a'), str_to_ord('z'))
+            or is_in_range(ch, str_to_ord('0'), str_to_ord('9')))
+			
+def is_in_range(a, low, high):
+    """
+    Return True if 'a' in 'low' <= a >= 'high'
+    """
+    return (a >= low and a <= high)
@@ -12,7 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
-# Requires Python 2.4+ and Openssl 1.0+
+# Requires Python 3.5+ and Openssl 1.0+
 
 
 # Output of running the script on Windows:
@@ -30,7 +30,7 @@ import time
 import util
 import sys
 if sys.platform == 'win32':
-    import _winreg as wreg
+    import winreg as wreg
 from uuid import getnode as get_mac
 
 """
@@ -73,15 +73,15 @@ class DhcpHandler(object):
 
     def _send_dhcp_req(self, request, debug):
         __waiting_duration__ = [0, 10, 30, 60, 60]
-        for duration in __waiting_duration__:
-            try:
-                self.osutil.allow_dhcp_broadcast()
-                response = socket_send(request, debug)
-                validate_dhcp_resp(request, response, debug)
-                return response
-            except DhcpError as e:
-                print("Failed to send DHCP request: {0}", e)
-            time.sleep(duration)
+        with self.osutil.allow_dhcp_broadcast():
+            for duration in __waiting_duration__:
+                try:
+                    response = socket_send(request, debug)
+                    validate_dhcp_resp(request, response, debug)
+                    return response
+                except DhcpError as e:
+                    print("Failed to send DHCP request: {0}", e)
+                time.sleep(duration)
         return None
 
     def send_dhcp_req(self, debug, donotaddtoenv, outputregistry):
@@ -357,10 +357,11 @@ def build_dhcp_request(mac_addr, request_broadcast, debug):
 def gen_trans_id():
     return os.urandom(4)
 
-parser = argparse.ArgumentParser()
-parser.add_argument('--debug', action='store_true', help='Enable running the script in debug mode')
-parser.add_argument('--donotaddtoenv', action='store_true', help='Do not add the scheduled events endpoint to environment variable')
-parser.add_argument('--outputregistry', action='store_true', help='Option to store ScheduledEvents IP address as registry value')
-args = parser.parse_args()
-dhcp = DhcpHandler()
-dhcp.run(args.debug, args.donotaddtoenv, args.outputregistry)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--debug', action='store_true', help='Enable running the script in debug mode')
+    parser.add_argument('--donotaddtoenv', action='store_true', help='Do not add the scheduled events endpoint to environment variable')
+    parser.add_argument('--outputregistry', action='store_true', help='Option to store ScheduledEvents IP address as registry value')
+    args = parser.parse_args()
+    dhcp = DhcpHandler()
+    dhcp.run(args.debug, args.donotaddtoenv, args.outputregistry)
@@ -21,17 +21,20 @@
 # The scheduled events endpoint IP address will be available as part of the
 # environment variable for all users.
 
-import argparse
 import os
+import random
 import socket
 import struct
-import array
 import time
-import util
+import byteutil
+import endpoint_cache
+import log
+import osutil
+import publisher
+import retry
 import sys
-if sys.platform == 'win32':
-    import winreg as wreg
-from uuid import getnode as get_mac
+
+logger = log.get_logger('discovery')
 
 """
 Defines dhcp exception
@@ -59,15 +62,152 @@ class DhcpError(BaseError):
         super(DhcpError, self).__init__('000006', msg, inner)
 
 
+# Where dhcp requests are sent.
+DHCP_SERVER = ("<broadcast>", 67)
+
+# The refresh runs at T1 scaled by a random factor in [1 - jitter, 1 + jitter]
+# so that machines that booted together do not rediscover together.
+REFRESH_JITTER = 0.1
+
+# Shortest wait before retrying a failed refresh (RFC 2131 4.4.5), and
+# before any refresh, so that a zero or tiny lease cannot spin.
+MIN_REFRESH_RETRY = 60.0
+
+# Lease time of a lease that never expires (RFC 2131 3.3); Azure hands
+# these out.
+INFINITE_LEASE = 0xFFFFFFFF
+
+
+def _running_loop():
+    import asyncio
+    try:
+        return asyncio.get_running_loop()
+    except AttributeError:
+        # Python < 3.7, where get_event_loop() returns the running loop
+        return asyncio.get_event_loop()
+
+
+def _in_event_loop():
+    # without asyncio loaded there cannot be a running loop
+    asyncio = sys.modules.get('asyncio')
+    if asyncio is None:
+        return False
+    try:
+        asyncio.get_running_loop()
+    except AttributeError:
+        # Python < 3.7
+        return asyncio._get_running_loop() is not None
+    except RuntimeError:
+        return False
+    return True
+
+
+def run_async(coro):
+    """
+    Run 'coro' to completion on a new event loop and return its result.
+    """
+    import asyncio
+    if hasattr(asyncio, 'run'):
+        return asyncio.run(coro)
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def _define_dhcp_client_protocol():
+    import asyncio
+
+    class DhcpClientProtocol(asyncio.DatagramProtocol):
+        """
+        Datagram protocol for one async dhcp exchange. Responses that do not
+        match the request (e.g. broadcast replies meant for another machine)
+        are dropped; the first matching one resolves the 'response' future.
+        Must be created while the event loop runs.
+        """
+
+        def __init__(self, request, debug, server=None):
+            self.request = request
+            self.debug = debug
+            self.server = server or DHCP_SERVER
+            self.transport = None
+            self.response = _running_loop().create_future()
+
+        def connection_made(self, transport):
+            self.transport = transport
+
+        def send(self):
+            self.transport.sendto(self.request, self.server)
+
+        def datagram_received(self, data, addr):
+            if self.response.done():
+                return
+            try:
+                validate_dhcp_resp(self.request, data, self.debug)
+            except DhcpError as e:
+                logger.debug("Dropping dhcp response from %s: %s", addr, e)
+                return
+            self.response.set_result(data)
+
+        def error_received(self, exc):
+            logger.warning("Dhcp socket error: %s", exc)
+
+        def connection_lost(self, exc):
+            if self.response.done():
+                return
+            if exc is None:
+                self.response.cancel()
+            else:
+                self.response.set_exception(
+                    DhcpError("Dhcp socket closed", exc))
+
+    return DhcpClientProtocol
+
+
+def _dhcp_client_protocol():
+    protocol = globals().get('DhcpClientProtocol')
+    if protocol is None:
+        protocol = globals()['DhcpClientProtocol'] = \
+            _define_dhcp_client_protocol()
+    return protocol
+
+
+def __getattr__(name):
+    # asyncio takes longer to import than the blocking discovery takes to
+    # run. DhcpClientProtocol subclasses asyncio.DatagramProtocol, so it is
+    # only defined once somebody asks for it
+    if name == 'DhcpClientProtocol':
+        return _dhcp_client_protocol()
+    raise AttributeError(
+        "module '{0}' has no attribute '{1}'".format(__name__, name))
+
+
+if sys.version_info < (3, 7):
+    # module __getattr__ (PEP 562) needs 3.7, define the protocol up front
+    _dhcp_client_protocol()
+
+
 class DhcpHandler(object):
 
     def __init__(self):
-        self.osutil = util.DefaultOSUtil()
+        self.osutil = osutil.DefaultOSUtil()
         self.endpoint = None
         self.gateway = None
         self.routes = None
+        self.lease_time = None
+        self.renewal_time = None
+        self.server_id = None
+        # time.time() when the lease was obtained
+        self.obtained = None
         self._request_broadcast = False
         self.skip_cache = False
+        self.retry_policy = retry.DHCP_RETRY_POLICY
+        self.all_interfaces = False
+        # Restricts all_interfaces discovery to these interface names.
+        self.interfaces = None
+        self.server = DHCP_SERVER
+        self.interface = None
 
     def run(self, debug, donotaddtoenv, outputregistry):
         """
@@ -77,17 +217,300 @@ class DhcpHandler(object):
         self.send_dhcp_req(debug, donotaddtoenv, outputregistry)
 
     def _send_dhcp_req(self, request, debug):
-        __waiting_duration__ = [0, 10, 30, 60, 60]
-        for duration in __waiting_duration__:
+        buf = bytearray(DHCP_RECV_BUFFER_SIZE)
+
+        def attempt(timeout):
             try:
-                self.osutil.allow_dhcp_broadcast()
-                response = socket_send(request, debug)
-                validate_dhcp_resp(request, response, debug)
-                return response
+                return socket_send(request, debug, timeout, buf, self.server)
             except DhcpError as e:
-                print("Failed to send DHCP request: {0}", e)
-            time.sleep(duration)
-        return None
+                logger.info("Failed to send DHCP request: %s", e,
+                            extra={'timeout': timeout})
+                raise
+
+        try:
+            return self.retry_policy.run(attempt, retry_on=(DhcpError,))
+        except DhcpError:
+            return None
+
+    async def discover_async(self, debug=False):
+        """
+        Discover the scheduled events endpoint without blocking the event
+        loop. The request is retransmitted at the end of each attempt of
+        retry_policy until a matching response arrives or the policy's
+        deadline passes. Returns the endpoint, or raises DhcpError on timeout.
+        """
+        if self._load_cache(debug):
+            return self.endpoint
+
+        mac_addr = self.osutil.get_mac_in_bytes()
+        req = build_dhcp_request(mac_addr, self._request_broadcast, debug)
+
+        dhcp_firewall = await self._allow_dhcp_broadcast_async()
+        try:
+            resp = await self._exchange_async(req, debug)
+        finally:
+            await self._remove_firewall_async(dhcp_firewall)
+
+        if resp is None:
+            raise DhcpError("Failed to receive dhcp response.")
+        self._handle_dhcp_resp(resp, debug)
+        return self.endpoint
+
+    async def discover_all_async(self, debug=False, first=True):
+        """
+        Run discovery concurrently on every up, non-loopback interface, each
+        with its own socket bound to the interface and its own MAC address.
+
+        With 'first', returns the endpoint of the first interface to answer
+        with option 245 and cancels the others. Otherwise waits for all of
+        them and returns a list of (interface, endpoint, gateway, routes)
+        for the interfaces that answered.
+        """
+        if first and self._load_cache(debug):
+            return self.endpoint
+
+        interfaces = self.osutil.get_interfaces()
+        if self.interfaces is not None:
+            interfaces = [(name, mac_addr) for name, mac_addr in interfaces
+                          if name in self.interfaces]
+        if not interfaces:
+            raise DhcpError("No eligible network interface found.")
+        logger.debug("Discovering on interfaces %s",
+                     log.Lazy(', '.join, [name for name, _ in interfaces]))
+
+        import asyncio
+        dhcp_firewall = await self._allow_dhcp_broadcast_async()
+        tasks = {}
+        try:
+            for name, mac_addr in interfaces:
+                req = build_dhcp_request(mac_addr, self._request_broadcast,
+                                         debug)
+                task = asyncio.ensure_future(
+                    self._exchange_async(req, debug, name))
+                tasks[task] = name
+            if first:
+                return await self._first_answer(tasks, debug)
+            return await self._all_answers(tasks, debug)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await self._remove_firewall_async(dhcp_firewall)
+
+    # Firewall changes exec a process, keep them off the event loop. Both
+    # helpers make sure a rule that was added is removed again even when
+    # the discovery is cancelled half way, e.g. by endpoint_resolver.
+
+    async def _allow_dhcp_broadcast_async(self):
+        import asyncio
+        opening = _running_loop().run_in_executor(
+            None, self.osutil.allow_dhcp_broadcast)
+        try:
+            return await asyncio.shield(opening)
+        except asyncio.CancelledError:
+            # the rule is being added regardless, take it down again
+            try:
+                dhcp_firewall = await opening
+            except Exception:
+                pass
+            else:
+                await self._remove_firewall_async(dhcp_firewall)
+            raise
+
+    async def _remove_firewall_async(self, dhcp_firewall):
+        import asyncio
+        await asyncio.shield(_running_loop().run_in_executor(
+            None, dhcp_firewall.remove))
+
+    async def _first_answer(self, tasks, debug):
+        import asyncio
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.cancelled() or task.exception() is not None:
+                    continue
+                resp = task.result()
+                if resp is None:
+                    continue
+                options = DhcpOptions(resp)
+                if 245 not in options:
+                    continue
+                self.interface = tasks[task]
+                logger.debug("Interface %s answered first", self.interface,
+                             extra={'interface': self.interface})
+                self._handle_dhcp_resp(resp, debug, options)
+                return self.endpoint
+        raise DhcpError("Failed to receive dhcp response on any interface.")
+
+    async def _all_answers(self, tasks, debug):
+        import asyncio
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        answers = []
+        for task, resp in zip(tasks, results):
+            if resp is None or isinstance(resp, BaseException):
+                continue
+            endpoint, gateway, routes = parse_dhcp_resp(resp, debug)
+            if endpoint is not None:
+                answers.append((tasks[task], endpoint, gateway, routes))
+        return answers
+
+    async def _exchange_async(self, req, debug, interface=None):
+        import asyncio
+        loop = _running_loop()
+        transport, protocol = await loop.create_datagram_endpoint(
+            lambda: _dhcp_client_protocol()(req, debug, self.server),
+            sock=open_dhcp_socket(interface))
+        resp = None
+        try:
+            for timeout in self.retry_policy.attempts(loop.time):
+                protocol.send()
+                try:
+                    resp = await asyncio.wait_for(
+                        asyncio.shield(protocol.response), timeout)
+                    break
+                except asyncio.TimeoutError:
+                    logger.debug("No dhcp response after %.3fs", timeout,
+                                 extra={'interface': interface,
+                                        'timeout': timeout})
+        finally:
+            transport.close()
+        return resp
+
+    def _load_cache(self, debug):
+        """
+        Populate the result from the endpoint cache unless skip_cache is set.
+        Returns True on a cache hit.
+        """
+        if self.skip_cache:
+            return False
+        # a probed address has no lease to reuse, only DHCP entries count
+        entry = endpoint_cache.load(source=endpoint_cache.SOURCE_DHCP)
+        if entry is None:
+            return False
+        logger.debug("Using cached endpoint from %s",
+                     log.Lazy(endpoint_cache.get_cache_path))
+        self.endpoint = entry['endpoint']
+        self.gateway = entry['gateway']
+        self.routes = entry['routes']
+        self.lease_time = entry['lease_time']
+        self.renewal_time = entry['renewal_time']
+        self.server_id = entry['server_id']
+        self.obtained = entry['timestamp']
+        return True
+
+    def _handle_dhcp_resp(self, resp, debug, options=None):
+        if options is None:
+            options = DhcpOptions(resp)
+        self.endpoint, self.gateway, self.routes = _parse_endpoint(options)
+        self.lease_time, self.renewal_time, self.server_id = \
+            _parse_lease(options)
+        self.obtained = time.time()
+        if self.endpoint is not None:
+            endpoint_cache.store(self.endpoint, self.gateway, self.routes,
+                                 self.lease_time, now=self.obtained,
+                                 renewal_time=self.renewal_time,
+                                 server_id=self.server_id)
+
+    def resolve(self, debug=False):
+        """
+        Fill in endpoint, gateway, routes and lease_time from the cache or
+        a dhcp exchange. Returns True on a cache hit, raises DhcpError if
+        no response arrives.
+        """
+        if self._load_cache(debug):
+            return True
+        if self.all_interfaces:
+            run_async(self.discover_all_async(debug))
+        else:
+            logger.debug("Sending dhcp request")
+            mac_addr = self.osutil.get_mac_in_bytes()
+            logger.debug("Mac address %s", log.Lazy(byteutil.hex_dump2, mac_addr))
+
+            req = build_dhcp_request(mac_addr, self._request_broadcast, debug)
+
+            with self.osutil.allow_dhcp_broadcast():
+                resp = self._send_dhcp_req(req, debug)
+
+            if resp is None:
+                raise DhcpError("Failed to receive dhcp response.")
+            self._handle_dhcp_resp(resp, debug)
+        return False
+
+    async def resolve_async(self, debug=False):
+        """
+        Same as resolve() without blocking the event loop.
+        """
+        if self._load_cache(debug):
+            return True
+        skip_cache = self.skip_cache
+        self.skip_cache = True
+        try:
+            if self.all_interfaces:
+                await self.discover_all_async(debug)
+            else:
+                await self.discover_async(debug)
+        finally:
+            self.skip_cache = skip_cache
+        return False
+
+    def refresh(self, debug=False):
+        """
+        Run a new dhcp exchange regardless of the cache, see resolve().
+        Raises DhcpError if the response carries no endpoint.
+        """
+        skip_cache = self.skip_cache
+        self.skip_cache = True
+        try:
+            self.resolve(debug)
+        finally:
+            self.skip_cache = skip_cache
+        if self.endpoint is None:
+            raise DhcpError("No scheduled events endpoint in dhcp response.")
+
+    def refresh_delay(self, jitter=REFRESH_JITTER, now=None):
+        """
+        Return the seconds until the jittered renewal time T1 of the current
+        lease, at least MIN_REFRESH_RETRY, or None if the lease is infinite.
+        Without option 58, T1 is half the lease time (RFC 2131 4.4.5).
+        """
+        if now is None:
+            now = time.time()
+        lease_time = self.lease_time
+        if lease_time is None:
+            lease_time = endpoint_cache.DEFAULT_LEASE_TIME
+        if lease_time >= INFINITE_LEASE:
+            return None
+        renewal_time = self.renewal_time
+        if renewal_time is None or renewal_time >= lease_time:
+            renewal_time = lease_time / 2.0
+        if jitter:
+            renewal_time *= random.uniform(1 - jitter, 1 + jitter)
+        elapsed = now - self.obtained if self.obtained is not None else 0
+        return max(MIN_REFRESH_RETRY, min(renewal_time, lease_time) - elapsed)
+
+    def retry_delay(self, now=None):
+        """
+        Return the seconds to wait after a failed refresh: half the time
+        left on the lease, and at least MIN_REFRESH_RETRY.
+        """
+        if now is None:
+            now = time.time()
+        lease_time = self.lease_time
+        if lease_time is None:
+            lease_time = endpoint_cache.DEFAULT_LEASE_TIME
+        remaining = lease_time
+        if self.obtained is not None:
+            remaining = self.obtained + lease_time - now
+        return max(MIN_REFRESH_RETRY, remaining / 2.0)
+
+    def start_refresh(self, on_refresh=None, jitter=REFRESH_JITTER,
+                      debug=False):
+        """
+        Re-run discovery in a background thread at T1 of every lease, see
+        LeaseRefresher. Returns the started LeaseRefresher.
+        """
+        return LeaseRefresher(self, on_refresh, jitter, debug).start()
 
     def send_dhcp_req(self, debug, donotaddtoenv, outputregistry):
         """
@@ -95,136 +518,465 @@ class DhcpHandler(object):
         Configure route to allow dhcp traffic
         Stop dhcp service if necessary
         """
-        if debug == True:
-            print("Sending dhcp request")
-        mac_addr = self.osutil.get_mac_in_bytes()
+        self.resolve(debug)
+        print_publication(self.endpoint, donotaddtoenv, outputregistry)
+        # Every sink skips the write when it already holds the endpoint.
+        publisher.publish(self.endpoint,
+                          publisher.default_sinks(donotaddtoenv == False,
+                                                  outputregistry == True))
 
-        if debug == True:
-            print('Mac address', mac_addr)
 
-        req = build_dhcp_request(mac_addr, self._request_broadcast, debug)
+class DiscoveryResult(object):
+    """
+    Outcome of discover().
 
-        resp = self._send_dhcp_req(req, debug)
+    routes: (net, mask, gateway) integer tuples from option 249, or None.
+    lease_time, renewal_time: options 51 and 58 in seconds, or None.
+    server_id: the DHCP server identifier, option 54, or None.
+    interface: the interface that answered, when discovering on several.
+    from_cache: True if the result came from the endpoint cache.
+    published: the publisher sinks whose value changed.
+    installed_routes: the option 249 routes that were added to the routing
+                      table.
+    timings: seconds spent per phase: 'resolve', 'routes', 'publish' and
+             'total'; results of a refresh have no 'resolve'.
+    refresher: the LeaseRefresher started by discover(refresh=...), or None.
+    """
 
-        if resp is None:
-            raise DhcpError("Failed to receive dhcp response.")
-        self.endpoint, self.gateway, self.routes = parse_dhcp_resp(resp, debug)
-        print('Scheduled Events endpoint IP address:', self.endpoint)
-
-        env_var = "SCHEDULEDEVENTSIP"
-        env_val = self.endpoint
-        if donotaddtoenv == False:
-            print('Adding Scheduled Events endpoint IP to the environment')
-            if sys.platform == 'win32':
-                os.system("SETX {0} {1} /M".format(env_var, env_val))
-
-            elif "linux" in sys.platform:
-                # Set the scheduled events IP address in the environment for the
-                # current process
-                os.environ['SCHEDULEDEVENTSIP'] = self.endpoint
-
-                # Set the scheduled events IP address in the environment for all users
-                # This is done by reading the file /etc/profile line by line
-                # Looking for a match to "export SCHEDULEDEVENTSIP="
-                # Writing the same file again excluding that line and appending that line again
-                # With the correct value of the IP address
-                f = open("/etc/profile", 'r')
-                match = "export SCHEDULEDEVENTSIP="
-                lines = f.readlines()
-                f.close()
-
-                f = open("/etc/profile", 'w')
-                for line in lines:
-                    if match not in line:
-                        f.write(line)
-                f.write("export {0}={1}\n".format(env_var, env_val))
-                f.close()
-            else:
-                print(
-                    'Unknown operating system detected. Cannot add the scheduled events IP to the environment')
-        if outputregistry == True and sys.platform == 'win32':
+    __slots__ = ('endpoint', 'gateway', 'routes', 'lease_time', 'interface',
+                 'from_cache', 'published', 'installed_routes', 'timings',
+                 'renewal_time', 'server_id', 'refresher')
+
+    def __init__(self, endpoint, gateway=None, routes=None, lease_time=None,
+                 interface=None, from_cache=False, published=(),
+                 timings=None, installed_routes=(), renewal_time=None,
+                 server_id=None, refresher=None):
+        self.endpoint = endpoint
+        self.gateway = gateway
+        self.routes = routes
+        self.lease_time = lease_time
+        self.renewal_time = renewal_time
+        self.server_id = server_id
+        self.interface = interface
+        self.from_cache = from_cache
+        self.published = list(published)
+        self.installed_routes = list(installed_routes)
+        self.timings = timings if timings is not None else {}
+        self.refresher = refresher
+
+    def to_dict(self):
+        def dotted(routes):
+            return [[byteutil.int_to_ip4_addr(net), byteutil.int_to_ip4_addr(mask),
+                     byteutil.int_to_ip4_addr(gateway)]
+                    for net, mask, gateway in routes or ()]
+
+        return {
+            'endpoint': self.endpoint,
+            'gateway': self.gateway,
+            'routes': dotted(self.routes),
+            'lease_time': self.lease_time,
+            'renewal_time': self.renewal_time,
+            'server_id': self.server_id,
+            'interface': self.interface,
+            'from_cache': self.from_cache,
+            'installed_routes': dotted(self.installed_routes),
+            'timings': dict(self.timings),
+        }
+
+    def __repr__(self):
+        return 'DiscoveryResult(endpoint={0!r}, gateway={1!r}, ' \
+            'from_cache={2!r})'.format(self.endpoint, self.gateway,
+                                       self.from_cache)
+
+
+class LeaseRefresher(object):
+    """
+    Background thread that re-runs the discovery of a DhcpHandler at the
+    jittered renewal time T1 of each lease and calls on_refresh(handler)
+    after every successful refresh. A failed refresh is retried after
+    DhcpHandler.retry_delay(). The thread is a daemon; stop() ends it, and
+    it ends by itself once the lease is infinite.
+    """
+
+    def __init__(self, handler, on_refresh=None, jitter=REFRESH_JITTER,
+                 debug=False):
+        import threading
+        self.handler = handler
+        self.on_refresh = on_refresh
+        self.jitter = jitter
+        self.debug = debug
+        self._stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run,
+                                       name='scheduledevents-refresh')
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        import threading
+        self._stopped.set()
+        if self.thread.is_alive() and \
+                self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+
+    def wait(self):
+        """
+        Block until stop() is called or the thread ends.
+        """
+        self._stopped.wait()
+
+    def _sleep(self, delay):
+        # Event.wait() raises OverflowError past TIMEOUT_MAX, which is
+        # about 50 days on Windows; returns True once stopped
+        import threading
+        end = time.monotonic() + delay
+        while True:
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return self._stopped.is_set()
+            if self._stopped.wait(min(remaining, threading.TIMEOUT_MAX)):
+                return True
+
+    def _run(self):
+        try:
+            self._refresh_loop()
+        finally:
+            self._stopped.set()
+
+    def _refresh_loop(self):
+        delay = self.handler.refresh_delay(self.jitter)
+        while True:
+            if delay is None:
+                logger.info("The lease of %s never expires, not refreshing",
+                            self.handler.endpoint)
+                return
+            logger.debug("Next endpoint refresh in %.0fs", delay,
+                         extra={'delay': delay})
+            if self._sleep(delay):
+                return
+            try:
+                self.handler.refresh(self.debug)
+            except (DhcpError, OSError) as e:
+                delay = self.handler.retry_delay()
+                logger.warning("Endpoint refresh failed, retrying in %.0fs: "
+                               "%s", delay, e)
+                continue
+            logger.info("Refreshed endpoint %s", self.handler.endpoint)
+            if self.on_refresh is not None:
+                try:
+                    self.on_refresh(self.handler)
+                except Exception:
+                    # publishing failed, e.g. an unwritable profile script;
+                    # the thread must not die with the lease still running
+                    delay = self.handler.retry_delay()
+                    logger.warning("Handling the refreshed endpoint failed, "
+                                   "retrying in %.0fs", delay, exc_info=True)
+                    continue
+            delay = self.handler.refresh_delay(self.jitter)
+
+
+def _complete(handler, start, from_cache, publish, install_routes, timings):
+    """
+    Install routes and publish after 'handler' resolved the endpoint, and
+    return the DiscoveryResult.
+    """
+    installed_routes = []
+    if install_routes and handler.routes:
+        routes_start = time.monotonic()
+        installed_routes = handler.osutil.add_routes(handler.routes,
+                                                     handler.interface)
+        timings['routes'] = time.monotonic() - routes_start
+
+    published = []
+    if publish:
+        publish_start = time.monotonic()
+        published = publisher.publish(handler.endpoint, publish)
+        timings['publish'] = time.monotonic() - publish_start
+    timings['total'] = time.monotonic() - start
+    logger.debug("Discovery timings: %s", timings, extra={'timings': timings})
+
+    return DiscoveryResult(handler.endpoint, handler.gateway, handler.routes,
+                           handler.lease_time, handler.interface, from_cache,
+                           published, timings, installed_routes,
+                           handler.renewal_time, handler.server_id)
+
+
+def discover(timeout=None, interfaces=None, publish=None, use_cache=True,
+             server=None, install_routes=False, refresh=None):
+    """
+    Discover the scheduled events endpoint and return a DiscoveryResult.
+
+    timeout: overall budget in seconds, the DHCP retry policy's by default.
+    interfaces: None sends one request on the default interface; True
+                races all eligible interfaces; a list of names races those.
+    publish: publisher sinks to hand the endpoint to; True uses
+             publisher.default_sinks(). Nothing is published by default.
+    use_cache: reuse an unexpired cached result instead of asking DHCP.
+    server: (address, port) the request is sent to.
+    install_routes: add the option 249 routes missing from the routing
+                    table (Linux).
+    refresh: when given, the endpoint is rediscovered in the background at
+             the jittered renewal time of each lease, routes installed and
+             published as above, and refresh(result) is called with each
+             new DiscoveryResult. result.refresher.stop() ends it.
+
+    Raises DhcpError if no response carries the endpoint. This blocks, and
+    raises RuntimeError when called from a running event loop; await
+    discover_async() there instead.
+    """
+    if _in_event_loop():
+        raise RuntimeError("discover() cannot be called from a running "
+                           "event loop, use discover_async()")
+    start = time.monotonic()
+    handler = _make_handler(timeout, interfaces, use_cache, server)
+    from_cache = handler.resolve()
+    return _discovered(handler, start, from_cache, publish, install_routes,
+                       refresh)
+
+
+async def discover_async(timeout=None, interfaces=None, publish=None,
+                         use_cache=True, server=None, install_routes=False,
+                         refresh=None):
+    """
+    Same as discover() for callers running an event loop. The DHCP
+    exchange runs on the loop; installing routes and publishing run in the
+    loop's default executor. A refresh still runs in a background thread
+    and calls refresh(result) from there.
+    """
+    start = time.monotonic()
+    handler = _make_handler(timeout, interfaces, use_cache, server)
+    from_cache = await handler.resolve_async()
+    return await _running_loop().run_in_executor(
+        None, _discovered, handler, start, from_cache, publish,
+        install_routes, refresh)
+
+
+def _make_handler(timeout, interfaces, use_cache, server):
+    handler = DhcpHandler()
+    handler.skip_cache = not use_cache
+    if timeout is not None:
+        handler.retry_policy = retry.DHCP_RETRY_POLICY.with_deadline(timeout)
+    if server is not None:
+        handler.server = server
+    if interfaces is not None:
+        handler.all_interfaces = True
+        if interfaces is not True:
+            handler.interfaces = list(interfaces)
+    return handler
+
+
+def _discovered(handler, start, from_cache, publish, install_routes,
+                refresh):
+    if publish is True:
+        publish = publisher.default_sinks()
+    if handler.endpoint is None:
+        raise DhcpError("No scheduled events endpoint in dhcp response.")
+    result = _complete(handler, start, from_cache, publish, install_routes,
+                       {'resolve': time.monotonic() - start})
+
+    if refresh is not None:
+        def refreshed(handler):
+            refresh(_complete(handler, time.monotonic(), False, publish,
+                              install_routes, {}))
+
+        result.refresher = handler.start_refresh(refreshed)
+    return result
+
+
+def watch(on_result=None, timeout=None, interfaces=None, publish=None,
+          server=None, settle=None, install_routes=False):
+    """
+    Re-run discovery whenever the primary interface, its addresses or the
+    default route change, until interrupted. The cached result is dropped
+    on every such change; discovery runs again once the primary interface
+    has an IPv4 address, and on_result(result) is called with each new
+    DiscoveryResult. The other arguments are passed on to discover().
+    Linux only.
+    """
+    import network_watcher
+
+    def changed(old, new):
+        endpoint_cache.invalidate()
+        if not new.is_connected:
+            logger.info("No primary interface address, waiting")
+            return
+        try:
+            result = discover(timeout, interfaces, publish, use_cache=False,
+                              server=server, install_routes=install_routes)
+        except (DhcpError, OSError) as e:
+            # e.g. netlink refusing the interface dump or the routes; the
+            # watcher must keep running for the next change
+            logger.warning("Rediscovery after network change failed: %s", e)
+            return
+        logger.info("Rediscovered endpoint %s", result.endpoint)
+        if on_result is not None:
+            on_result(result)
+
+    if settle is None:
+        settle = network_watcher.DEFAULT_SETTLE
+    with network_watcher.NetworkWatcher(changed, settle) as watcher:
+        watcher.run()
+
+
+def print_publication(endpoint, donotaddtoenv, outputregistry):
+    print('Scheduled Events endpoint IP address:', endpoint)
+    if donotaddtoenv == False:
+        print('Adding Scheduled Events endpoint IP to the environment')
+        if sys.platform != 'win32' and "linux" not in sys.platform:
             print(
-                'Adding Scheduled Events endpoint to registry location HKEY_LOCAL_MACHINE\\Software\\ScheduledEvents')
-            key = wreg.CreateKey(wreg.HKEY_LOCAL_MACHINE,
-                                 "Software\\ScheduledEvents")
-            # Create new value
-            wreg.SetValueEx(key, 'ScheduledEventsIp', 0,
-                            wreg.REG_SZ, self.endpoint)
-            print(wreg.QueryValueEx(key, 'ScheduledEventsIp'))
-            key.Close()
+                'Unknown operating system detected. Cannot add the scheduled events IP to the environment')
+    if outputregistry == True and sys.platform == 'win32':
+        print(
+            'Adding Scheduled Events endpoint to registry location HKEY_LOCAL_MACHINE\\Software\\ScheduledEvents')
 
 
 def validate_dhcp_resp(request, response, debug):
     bytes_recv = len(response)
     if bytes_recv < 0xF6:
-        print("HandleDhcpResponse: Too few bytes received:{0}",
-              bytes_recv)
-        return False
+        logger.debug("HandleDhcpResponse: Too few bytes received:%d",
+                     bytes_recv)
+        raise DhcpError("Too few bytes in dhcp response")
 
-    if debug == True:
-        print("BytesReceived:{0}", hex(bytes_recv))
-        print("DHCP response:{0}", util.hex_dump(response, bytes_recv))
+    # every response goes through here, skip building the call when quiet
+    if logger.isEnabledFor(log.DEBUG):
+        logger.debug("DHCP response of %d bytes:\n%s", bytes_recv,
+                     log.Lazy(byteutil.hex_dump, response, bytes_recv),
+                     extra={'bytes_received': bytes_recv})
 
     # check transactionId, cookie, MAC address cookie should never mismatch
     # transactionId and MAC address may mismatch if we see a response
     # meant from another machine
-    if not util.compare_bytes(request, response, 0xEC, 4):
-        print("Cookie not match:\nsend={0},\nreceive={1}",
-              util.hex_dump3(request, 0xEC, 4),
-              util.hex_dump3(response, 0xEC, 4))
+    if not byteutil.compare_bytes(request, response, 0xEC, 4):
+        logger.debug("Cookie not match: send=%s, receive=%s",
+                     log.Lazy(byteutil.hex_dump3, request, 0xEC, 4),
+                     log.Lazy(byteutil.hex_dump3, response, 0xEC, 4))
         raise DhcpError("Cookie in dhcp respones doesn't match the request")
 
-    if not util.compare_bytes(request, response, 4, 4):
-        print("TransactionID not match:\nsend={0},\nreceive={1}",
-              util.hex_dump3(request, 4, 4),
-              util.hex_dump3(response, 4, 4))
+    if not byteutil.compare_bytes(request, response, 4, 4):
+        logger.debug("TransactionID not match: send=%s, receive=%s",
+                     log.Lazy(byteutil.hex_dump3, request, 4, 4),
+                     log.Lazy(byteutil.hex_dump3, response, 4, 4))
         raise DhcpError("TransactionID in dhcp respones "
                         "doesn't match the request")
 
-    if not util.compare_bytes(request, response, 0x1C, 6):
-        print("Mac Address not match:\nsend={0},\nreceive={1}",
-              util.hex_dump3(request, 0x1C, 6),
-              util.hex_dump3(response, 0x1C, 6))
+    if not byteutil.compare_bytes(request, response, 0x1C, 6):
+        logger.debug("Mac Address not match: send=%s, receive=%s",
+                     log.Lazy(byteutil.hex_dump3, request, 0x1C, 6),
+                     log.Lazy(byteutil.hex_dump3, response, 0x1C, 6))
         raise DhcpError("Mac Addr in dhcp respones "
                         "doesn't match the request")
 
 
-def parse_route(response, option, i, length, bytes_recv):
-    # http://msdn.microsoft.com/en-us/library/cc227282%28PROT.10%29.aspx
-    print("Routes at offset: {0} with length:{1}", hex(i),
-          hex(length))
-    routes = []
-    if length < 5:
-        print("Data too small for option:{0}", option)
-    j = i + 2
-    while j < (i + length + 2):
-        mask_len_bits = util.str_to_ord(response[j])
-        mask_len_bytes = (((mask_len_bits + 7) & ~7) >> 3)
-        mask = 0xFFFFFFFF & (0xFFFFFFFF << (32 - mask_len_bits))
-        j += 1
-        net = util.unpack_big_endian(response, j, mask_len_bytes)
-        net <<= (32 - mask_len_bytes * 8)
-        net &= mask
-        j += mask_len_bytes
-        gateway = util.unpack_big_endian(response, j, 4)
-        j += 4
-        routes.append((net, mask, gateway))
-    if j != (i + length + 2):
-        print("Unable to parse routes")
-    return routes
-
-
-def parse_ip_addr(response, option, i, length, bytes_recv):
-    if i + 5 < bytes_recv:
-        if length != 4:
-            print("Endpoint or Default Gateway not 4 bytes")
+class DhcpOptions(object):
+    """
+    Index of the options carried in a dhcp response.
+
+    The options area is scanned once over a memoryview of the response and
+    the offset and length of each option are recorded by option code.
+    Option values are only decoded when asked for.
+    """
+
+    __slots__ = ('buf', 'table', 'end')
+
+    def __init__(self, response):
+        self.buf = memoryview(response)
+        self.table = {}
+        self.end = None
+
+        buf = self.buf
+        table = self.table
+        bytes_recv = len(buf)
+        i = 0xF0  # offset to first option
+        while i < bytes_recv:
+            option = buf[i]
+            if option == 0:
+                # pad
+                i += 1
+                continue
+            if option == 255:
+                self.end = i
+                break
+            if i + 1 >= bytes_recv:
+                break
+            length = buf[i + 1]
+            if i + 2 + length > bytes_recv:
+                # truncated option, ignore it and anything after it
+                break
+            # the first occurrence of an option wins
+            if option not in table:
+                table[option] = (i + 2, length)
+            i += length + 2
+
+    def __contains__(self, option):
+        return option in self.table
+
+    def __iter__(self):
+        return iter(self.table)
+
+    def get(self, option):
+        """
+        Return the value of 'option' as a memoryview, or None if absent.
+        """
+        entry = self.table.get(option)
+        if entry is None:
+            return None
+        offset, length = entry
+        return self.buf[offset:offset + length]
+
+    def get_uint32(self, option):
+        """
+        Return a 4 byte option as an unsigned integer, or None.
+        """
+        value = self.get(option)
+        if value is None or len(value) != 4:
             return None
-        addr = util.unpack_big_endian(response, i + 2, 4)
-        ip_addr = util.int_to_ip4_addr(addr)
-        return ip_addr
-    else:
-        print("Data too small for option:{0}", option)
-    return None
+        return int.from_bytes(value, 'big')
+
+    def get_ip_addr(self, option):
+        """
+        Return a 4 byte option as a dotted IPv4 address, or None.
+        """
+        addr = self.get_uint32(option)
+        if addr is None:
+            if option in self.table:
+                logger.warning("Option %d is not 4 bytes", option)
+            return None
+        return byteutil.int_to_ip4_addr(addr)
+
+    def get_routes(self, option=249):
+        """
+        Return the classless static routes in 'option' as a list of
+        (net, mask, gateway) integer tuples, or None if absent.
+        """
+        # http://msdn.microsoft.com/en-us/library/cc227282%28PROT.10%29.aspx
+        value = self.get(option)
+        if value is None:
+            return None
+        length = len(value)
+        if length < 5:
+            logger.warning("Data too small for option:%d", option)
+        routes = []
+        j = 0
+        while j < length:
+            mask_len_bits = value[j]
+            if mask_len_bits > 32:
+                break
+            mask_len_bytes = (mask_len_bits + 7) >> 3
+            j += 1
+            if j + mask_len_bytes + 4 > length:
+                break
+            mask = 0xFFFFFFFF & (0xFFFFFFFF << (32 - mask_len_bits))
+            net = int.from_bytes(value[j:j + mask_len_bytes], 'big')
+            net = (net << (32 - mask_len_bytes * 8)) & mask
+            j += mask_len_bytes
+            gateway = int.from_bytes(value[j:j + 4], 'big')
+            j += 4
+            routes.append((net, mask, gateway))
+        if j != length:
+            logger.warning("Unable to parse routes")
+        return routes
 
 
 def parse_dhcp_resp(response, debug):
@@ -232,64 +984,108 @@ def parse_dhcp_resp(response, debug):
     Parse DHCP response:
     Returns endpoint server or None on error.
     """
-    if debug == True:
-        print('Parsing Dhcp response')
-    bytes_recv = len(response)
-    endpoint = None
-    gateway = None
-    routes = None
-
-    # Walk all the returned options, parsing out what we need, ignoring the
-    # others. We need the custom option 245 to find the the endpoint we talk to
-    # options 3 for default gateway and 249 for routes; 255 is end.
-
-    i = 0xF0  # offset to first option
-    while i < bytes_recv:
-        option = util.str_to_ord(response[i])
-        length = 0
-        if (i + 1) < bytes_recv:
-            length = util.str_to_ord(response[i + 1])
-            if debug == True:
-                print("DHCP option {0} at offset:{1} with length:{2}", hex(
-                    option), hex(i), hex(length))
-        if option == 255:
-            if debug == True:
-                print("DHCP packet ended at offset:{0}", hex(i))
-            break
-        elif option == 249:
-            routes = parse_route(response, option, i, length, bytes_recv)
-        elif option == 3:
-            gateway = parse_ip_addr(response, option, i, length, bytes_recv)
-            if debug == True:
-                print("Default gateway:{0}, at {1}", gateway, hex(i))
-        elif option == 245:
-            endpoint = parse_ip_addr(response, option, i, length, bytes_recv)
-            if debug == True:
-                print(
-                    "Azure scheduled events endpoint IP:{0}, at {1}", endpoint, hex(i))
-        else:
-            if debug == True:
-                print("Skipping DHCP option:{0} at {1} with length {2}", hex(
-                    option), hex(i), hex(length))
-        i += length + 2
+    return _parse_endpoint(DhcpOptions(response))
+
+
+def _parse_endpoint(options):
+    # We need the custom option 245 to find the the endpoint we talk to,
+    # options 3 for default gateway and 249 for routes; others are ignored.
+    trace = logger.isEnabledFor(log.DEBUG)
+    if trace:
+        for option, (offset, length) in sorted(options.table.items(),
+                                               key=lambda o: o[1]):
+            logger.debug("DHCP option %#x at offset:%#x with length:%#x",
+                         option, offset - 2, length,
+                         extra={'option': option, 'offset': offset - 2,
+                                'length': length})
+        if options.end is not None:
+            logger.debug("DHCP packet ended at offset:%#x", options.end)
+
+    endpoint = options.get_ip_addr(245)
+    gateway = options.get_ip_addr(3)
+    routes = options.get_routes(249)
+    if trace:
+        logger.debug("Azure scheduled events endpoint IP:%s, "
+                     "default gateway:%s", endpoint, gateway,
+                     extra={'endpoint': endpoint, 'gateway': gateway})
     return endpoint, gateway, routes
 
 
-def socket_send(request, debug):
-    sock = None
+def parse_lease(response):
+    """
+    Return the lease time (option 51) and renewal time T1 (option 58) in
+    seconds and the server identifier (option 54), each None if absent.
+    """
+    return _parse_lease(DhcpOptions(response))
+
+
+def _parse_lease(options):
+    lease_time = options.get_uint32(51)
+    renewal_time = options.get_uint32(58)
+    server_id = options.get_ip_addr(54)
+    logger.debug("Lease time:%s, renewal time:%s, server:%s", lease_time,
+                 renewal_time, server_id,
+                 extra={'lease_time': lease_time,
+                        'renewal_time': renewal_time,
+                        'server_id': server_id})
+    return lease_time, renewal_time, server_id
+
+
+def open_dhcp_socket(interface=None):
+    """
+    Return a udp socket bound to the dhcp client port with broadcast enabled.
+    If 'interface' is given the socket only sends and receives on it.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM,
+                         socket.IPPROTO_UDP)
     try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM,
-                             socket.IPPROTO_UDP)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if interface is not None:
+            # SO_BINDTODEVICE from linux/socket.h
+            sock.setsockopt(socket.SOL_SOCKET,
+                            getattr(socket, 'SO_BINDTODEVICE', 25),
+                            interface.encode('utf-8'))
         sock.bind(("0.0.0.0", 68))
-        sock.sendto(request, ("<broadcast>", 67))
-        sock.settimeout(10)
-        if debug == True:
-            print("Send DHCP request: Setting socket.timeout=10, "
-                  "entering recv")
-        response = sock.recv(1024)
-        return response
+    except IOError:
+        sock.close()
+        raise
+    return sock
+
+
+# Large enough for any reply that fits an ethernet frame.
+DHCP_RECV_BUFFER_SIZE = 1500
+
+
+def socket_send(request, debug, timeout=10, buf=None, server=None):
+    """
+    Broadcast the request and return the first response that matches it
+    within 'timeout' seconds. Responses meant for other machines are
+    dropped. 'buf' is reused for receiving if given. The request goes to
+    'server', DHCP_SERVER by default.
+    """
+    if buf is None:
+        buf = bytearray(DHCP_RECV_BUFFER_SIZE)
+    view = memoryview(buf)
+    sock = None
+    try:
+        sock = open_dhcp_socket()
+        end = time.monotonic() + timeout
+        sock.sendto(request, server or DHCP_SERVER)
+        logger.debug("Send DHCP request: waiting %.3fs for a matching "
+                     "response", timeout, extra={'timeout': timeout})
+        while True:
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                raise DhcpError("Timed out waiting for a matching response")
+            sock.settimeout(remaining)
+            bytes_recv = sock.recv_into(buf)
+            try:
+                validate_dhcp_resp(request, view[:bytes_recv], debug)
+            except DhcpError as e:
+                logger.debug("Dropping dhcp response: %s", e)
+                continue
+            return bytes(view[:bytes_recv])
     except IOError as e:
         raise DhcpError("{0}".format(e))
     finally:
@@ -297,88 +1093,151 @@ def socket_send(request, debug):
             sock.close()
 
 
-def build_dhcp_request(mac_addr, request_broadcast, debug):
-    """
-    Build DHCP request string.
-    """
-    #
-    # typedef struct _DHCP {
-    #  UINT8   Opcode;                    /* op:    BOOTREQUEST or BOOTREPLY */
-    #  UINT8   HardwareAddressType;       /* htype: ethernet */
-    #  UINT8   HardwareAddressLength;     /* hlen:  6 (48 bit mac address) */
-    #  UINT8   Hops;                      /* hops:  0 */
-    #  UINT8   TransactionID[4];          /* xid:   random */
-    #  UINT8   Seconds[2];                /* secs:  0 */
-    #  UINT8   Flags[2];                  /* flags: 0 or 0x8000 for broadcast*/
-    #  UINT8   ClientIpAddress[4];        /* ciaddr: 0 */
-    #  UINT8   YourIpAddress[4];          /* yiaddr: 0 */
-    #  UINT8   ServerIpAddress[4];        /* siaddr: 0 */
-    #  UINT8   RelayAgentIpAddress[4];    /* giaddr: 0 */
-    #  UINT8   ClientHardwareAddress[16]; /* chaddr: 6 byte eth MAC address */
-    #  UINT8   ServerName[64];            /* sname:  0 */
-    #  UINT8   BootFileName[128];         /* file:   0  */
-    #  UINT8   MagicCookie[4];            /*   99  130   83   99 */
-    #                                        /* 0x63 0x82 0x53 0x63 */
-    #     /* options -- hard code ours */
-    #
-    #     UINT8 MessageTypeCode;              /* 53 */
-    #     UINT8 MessageTypeLength;            /* 1 */
-    #     UINT8 MessageType;                  /* 1 for DISCOVER */
-    #     UINT8 End;                          /* 255 */
-    # } DHCP;
-    #
-
-    # tuple of 244 zeros
-    # (struct.pack_into would be good here, but requires Python 2.5)
-    request = [0] * 244
-
-    trans_id = gen_trans_id()
-
-    # Opcode = 1
-    # HardwareAddressType = 1 (ethernet/MAC)
-    # HardwareAddressLength = 6 (ethernet/MAC/48 bits)
-    for a in range(0, 3):
-        request[a] = [1, 1, 6][a]
-
-    # fill in transaction id (random number to ensure response matches request)
-    for a in range(0, 4):
-        request[4 + a] = util.str_to_ord(trans_id[a])
+#
+# typedef struct _DHCP {
+#  UINT8   Opcode;                    /* op:    BOOTREQUEST or BOOTREPLY */
+#  UINT8   HardwareAddressType;       /* htype: ethernet */
+#  UINT8   HardwareAddressLength;     /* hlen:  6 (48 bit mac address) */
+#  UINT8   Hops;                      /* hops:  0 */
+#  UINT8   TransactionID[4];          /* xid:   random */
+#  UINT8   Seconds[2];                /* secs:  0 */
+#  UINT8   Flags[2];                  /* flags: 0 or 0x8000 for broadcast*/
+#  UINT8   ClientIpAddress[4];        /* ciaddr: 0 */
+#  UINT8   YourIpAddress[4];          /* yiaddr: 0 */
+#  UINT8   ServerIpAddress[4];        /* siaddr: 0 */
+#  UINT8   RelayAgentIpAddress[4];    /* giaddr: 0 */
+#  UINT8   ClientHardwareAddress[16]; /* chaddr: 6 byte eth MAC address */
+#  UINT8   ServerName[64];            /* sname:  0 */
+#  UINT8   BootFileName[128];         /* file:   0  */
+#  UINT8   MagicCookie[4];            /*   99  130   83   99 */
+#                                        /* 0x63 0x82 0x53 0x63 */
+#     /* options -- hard code ours */
+#
+#     UINT8 MessageTypeCode;              /* 53 */
+#     UINT8 MessageTypeLength;            /* 1 */
+#     UINT8 MessageType;                  /* 1 for DISCOVER */
+#     UINT8 End;                          /* 255 */
+# } DHCP;
+#
 
-    if debug == True:
-        print("BuildDhcpRequest: transactionId:%s,%04X" % (
-            util.hex_dump2(trans_id),
-            util.unpack_big_endian(request, 4, 4)))
+# Opcode, HardwareAddressType, HardwareAddressLength, Hops
+DHCP_HEADER = struct.Struct("!BBBB")
+# TransactionID, Seconds (left 0), Flags, Client/Your/Server/Relay IP
+# addresses (left 0), first 6 bytes of ClientHardwareAddress
+DHCP_REQUEST_FIELDS = struct.Struct("!4s2xH16x6s")
+# MagicCookie, MessageTypeCode, MessageTypeLength, MessageType, End
+DHCP_DISCOVER_OPTIONS = struct.Struct("!4sBBBB")
 
-    if request_broadcast:
-        # set broadcast flag to true to request the dhcp sever
-        # to respond to a boradcast address,
-        # this is useful when user dhclient fails.
-        request[0x0A] = 0x80
+DHCP_FLAG_BROADCAST = 0x8000
 
-    # fill in ClientHardwareAddress
-    for a in range(0, 6):
-        request[0x1C + a] = util.str_to_ord(mac_addr[a])
 
+def _build_dhcp_request_template():
+    template = bytearray(244)
+    # Opcode = 1 (BOOTREQUEST)
+    # HardwareAddressType = 1 (ethernet/MAC)
+    # HardwareAddressLength = 6 (ethernet/MAC/48 bits)
+    DHCP_HEADER.pack_into(template, 0, 1, 1, 6, 0)
     # DHCP Magic Cookie: 99, 130, 83, 99
     # MessageTypeCode = 53 DHCP Message Type
     # MessageTypeLength = 1
     # MessageType = DHCPDISCOVER
     # End = 255 DHCP_END
-    for a in range(0, 8):
-        request[0xEC + a] = [99, 130, 83, 99, 53, 1, 1, 255][a]
-    return array.array("B", request)
+    DHCP_DISCOVER_OPTIONS.pack_into(template, 0xEC, b"\x63\x82\x53\x63",
+                                    53, 1, 1, 255)
+    return bytes(template)
+
+
+# Immutable DHCPDISCOVER shared by every request; only the fields in
+# DHCP_REQUEST_FIELDS differ between requests.
+DHCP_REQUEST_TEMPLATE = _build_dhcp_request_template()
+
+
+def patch_dhcp_request(request, mac_addr, request_broadcast, trans_id):
+    """
+    Fill in the transaction id, flags and client hardware address of a
+    request copied from DHCP_REQUEST_TEMPLATE, in place.
+    """
+    # set broadcast flag to true to request the dhcp sever
+    # to respond to a boradcast address,
+    # this is useful when user dhclient fails.
+    flags = DHCP_FLAG_BROADCAST if request_broadcast else 0
+    DHCP_REQUEST_FIELDS.pack_into(request, 4, bytes(trans_id), flags,
+                                  bytes(mac_addr[:6]))
+
+
+def build_dhcp_request(mac_addr, request_broadcast, debug):
+    """
+    Build DHCP request string.
+    """
+    request = bytearray(DHCP_REQUEST_TEMPLATE)
+
+    # transaction id is a random number to ensure response matches request
+    trans_id = gen_trans_id()
+    patch_dhcp_request(request, mac_addr, request_broadcast, trans_id)
+
+    logger.debug("BuildDhcpRequest: transactionId:%s",
+                 log.Lazy(byteutil.hex_dump2, trans_id))
+    return request
 
 
 def gen_trans_id():
     return os.urandom(4)
 
-parser = argparse.ArgumentParser()
-parser.add_argument('--debug', action='store_true',
-                    help='Enable running the script in debug mode')
-parser.add_argument('--donotaddtoenv', action='store_true',
-                    help='Do not add the scheduled events endpoint to environment variable')
-parser.add_argument('--outputregistry', action='store_true',
-                    help='Option to store ScheduledEvents IP address as registry value')
-args = parser.parse_args()
-dhcp = DhcpHandler()
-dhcp.run(args.debug, args.donotaddtoenv, args.outputregistry)
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--debug', action='store_true',
+                        help='Enable running the script in debug mode')
+    parser.add_argument('--donotaddtoenv', action='store_true',
+                        help='Do not add the scheduled events endpoint to environment variable')
+    parser.add_argument('--outputregistry', action='store_true',
+                        help='Option to store ScheduledEvents IP address as registry value')
+    parser.add_argument('--skipcache', action='store_true',
+                        help='Ignore the cached endpoint and send a new dhcp request')
+    parser.add_argument('--timeout', type=float,
+                        default=retry.DHCP_RETRY_POLICY.deadline,
+                        help='Overall discovery budget in seconds')
+    parser.add_argument('--allinterfaces', action='store_true',
+                        help='Discover on all network interfaces concurrently')
+    parser.add_argument('--jsonlog', action='store_true',
+                        help='Write log records as JSON lines')
+    parser.add_argument('--installroutes', action='store_true',
+                        help='Add the classless static routes (option 249) missing from the routing table (Linux)')
+    parser.add_argument('--refresh', action='store_true',
+                        help='Keep running and rediscover at the renewal time of each lease')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running and rediscover when the network changes (Linux)')
+    args = parser.parse_args(argv)
+    log.configure(args.debug, args.jsonlog)
+    interfaces = True if args.allinterfaces else None
+    sinks = publisher.default_sinks(args.donotaddtoenv == False,
+                                    args.outputregistry == True)
+    def published(result):
+        print_publication(result.endpoint, args.donotaddtoenv,
+                          args.outputregistry)
+
+    result = None
+    try:
+        result = discover(args.timeout, interfaces, sinks,
+                          use_cache=not args.skipcache,
+                          install_routes=args.installroutes,
+                          refresh=published if args.refresh else None)
+    except DhcpError as e:
+        print('Unable to discover the Scheduled Events endpoint: {0}'.format(e))
+        if not args.watch:
+            return 1
+    else:
+        published(result)
+    try:
+        if args.watch:
+            watch(published, args.timeout, interfaces, sinks,
+                  install_routes=args.installroutes)
+        elif result is not None and result.refresher is not None:
+            result.refresher.wait()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
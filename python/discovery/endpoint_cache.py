@@ -0,0 +1,156 @@
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 3.5+
+
+"""
+On-disk cache of the scheduled events endpoint discovery result.
+
+The entry records the endpoint, gateway and routes from the DHCP response
+together with the time it was obtained, the lease and renewal times, the
+DHCP server and the interface (MAC address) it was obtained on, and the
+source of the endpoint: a DHCP exchange, or a probe of a well-known address
+that carries no lease at all. An entry is only returned while the lease is
+still valid and the interface has not changed.
+"""
+
+import json
+import os
+import sys
+import time
+
+import log
+
+logger = log.get_logger('endpoint_cache')
+
+# Lease time to assume when the DHCP response carries none, or when the
+# endpoint was not found through DHCP.
+DEFAULT_LEASE_TIME = 3600
+
+# Where an entry's endpoint came from.
+SOURCE_DHCP = 'dhcp'
+SOURCE_PROBE = 'probe'
+
+
+def get_cache_path():
+    """
+    Return the location of the cache file. SCHEDULEDEVENTSCACHE overrides
+    the platform default.
+    """
+    path = os.getenv('SCHEDULEDEVENTSCACHE')
+    if path:
+        return path
+    if sys.platform == 'win32':
+        root = os.getenv('PROGRAMDATA', 'C:\\ProgramData')
+        return os.path.join(root, 'ScheduledEvents', 'endpoint.json')
+    return '/var/lib/scheduledevents/endpoint.json'
+
+
+def get_interface_id():
+    """
+    Return an identifier of the interface the discovery is bound to.
+    """
+    from uuid import getnode as get_mac
+    return '%012x' % get_mac()
+
+
+def load(path=None, interface=None, now=None, source=None):
+    """
+    Return the cached entry as a dict, or None if there is no entry, it is
+    unreadable, its lease expired, it was recorded on another interface or,
+    when 'source' is given, it came from another source.
+    """
+    if path is None:
+        path = get_cache_path()
+    if interface is None:
+        interface = get_interface_id()
+    if now is None:
+        now = time.time()
+    try:
+        with open(path, 'r') as f:
+            entry = json.load(f)
+        expires = entry['timestamp'] + entry['lease_time']
+        if entry['interface'] != interface or not entry['endpoint']:
+            return None
+    except (IOError, ValueError, KeyError, TypeError):
+        return None
+    if now >= expires or now < entry['timestamp']:
+        return None
+    entry['routes'] = [tuple(r) for r in entry['routes']] \
+        if entry.get('routes') is not None else None
+    # entries written by earlier versions have no renewal time, server or
+    # source; without a source nobody can tell whether DHCP handed it out
+    entry.setdefault('renewal_time', None)
+    entry.setdefault('server_id', None)
+    entry.setdefault('source', None)
+    if source is not None and entry['source'] != source:
+        return None
+    return entry
+
+
+def store(endpoint, gateway=None, routes=None, lease_time=None, path=None,
+          interface=None, now=None, renewal_time=None, server_id=None,
+          source=SOURCE_DHCP):
+    """
+    Record a discovery result obtained from 'source'. The file is written to a temporary name and
+    renamed over the previous entry so readers never see a partial file.
+    Failures to write are reported and otherwise ignored.
+    """
+    if path is None:
+        path = get_cache_path()
+    if interface is None:
+        interface = get_interface_id()
+    if now is None:
+        now = time.time()
+    if lease_time is None:
+        lease_time = DEFAULT_LEASE_TIME
+    entry = {
+        'endpoint': endpoint,
+        'gateway': gateway,
+        'routes': routes,
+        'timestamp': now,
+        'lease_time': lease_time,
+        'renewal_time': renewal_time,
+        'server_id': server_id,
+        'interface': interface,
+        'source': source,
+    }
+    tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+    try:
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(tmp, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp, path)
+    except (IOError, OSError) as e:
+        logger.warning('Unable to write endpoint cache %s: %s', path, e)
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return False
+    return True
+
+
+def invalidate(path=None):
+    """
+    Remove the cached entry.
+    """
+    if path is None:
+        path = get_cache_path()
+    try:
+        os.remove(path)
+    except OSError:
+        pass
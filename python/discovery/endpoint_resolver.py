@@ -0,0 +1,211 @@
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 3.5+
+
+"""
+Resolves the Scheduled Events endpoint by racing every candidate source.
+
+An address given explicitly is probed first and used if it answers. Next
+comes the cached discovery result, which is trusted without a round trip.
+Only then are the candidate addresses (the VNET default, the environment
+and the registry) each probed with a bounded request, racing a live DHCP
+discovery if asked for. A probed address only counts if it answers with a
+scheduled events document. The first source to produce a valid endpoint
+wins and the others are cancelled.
+"""
+
+import asyncio
+import json
+import sys
+
+import address
+import endpoint_cache
+import log
+
+logger = log.get_logger('endpoint_resolver')
+
+# Default IP address for machines in VNET.
+VNET_IP_ADDRESS = '169.254.169.254'
+
+# Per-probe budget in seconds.
+PROBE_TIMEOUT = 1.0
+
+# Largest probe response read; a scheduled events document is far smaller.
+MAX_PROBE_RESPONSE = 1 << 20
+
+
+async def probe(ip_address, headers=None, timeout=PROBE_TIMEOUT):
+    """
+    Return 'ip_address' if it answers a scheduled events GET with status
+    200 and a JSON document carrying a DocumentIncarnation within 'timeout'
+    seconds, otherwise None.
+    """
+    lines = ['GET {0} HTTP/1.1'.format(address.SCHEDULED_EVENTS_PATH),
+             'Host: {0}'.format(ip_address), 'Metadata: true',
+             'Connection: close']
+    for name, value in (headers or {}).items():
+        if name.lower() not in ('metadata', 'host', 'connection'):
+            lines.append('{0}: {1}'.format(name, value))
+    request = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+    async def check():
+        reader, writer = await asyncio.open_connection(ip_address, 80)
+        try:
+            writer.write(request)
+            status = await reader.readline()
+            if status.split()[1:2] != [b'200']:
+                return False
+            chunked = False
+            length = None
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.partition(b':')
+                if name.strip().lower() == b'transfer-encoding' and \
+                        b'chunked' in value.lower():
+                    chunked = True
+                elif name.strip().lower() == b'content-length':
+                    length = int(value)
+            if chunked:
+                body = await _read_chunked(reader)
+            elif length is not None:
+                body = await reader.readexactly(
+                    min(length, MAX_PROBE_RESPONSE))
+            else:
+                # the request asked the server to close the connection
+                body = await _read_to_end(reader)
+        finally:
+            writer.close()
+        return _is_document(body)
+
+    try:
+        if await asyncio.wait_for(check(), timeout):
+            return ip_address
+    except (OSError, ValueError, asyncio.TimeoutError,
+            asyncio.IncompleteReadError):
+        pass
+    return None
+
+
+async def _read_chunked(reader):
+    body = bytearray()
+    while True:
+        size = int((await reader.readline()).split(b';', 1)[0], 16)
+        if size == 0 or len(body) + size > MAX_PROBE_RESPONSE:
+            return bytes(body)
+        body += await reader.readexactly(size)
+        await reader.readline()
+
+
+async def _read_to_end(reader):
+    body = bytearray()
+    while len(body) < MAX_PROBE_RESPONSE:
+        data = await reader.read(MAX_PROBE_RESPONSE - len(body))
+        if not data:
+            break
+        body += data
+    return bytes(body)
+
+
+def _is_document(body):
+    """
+    Return True if 'body' is a scheduled events document, as opposed to
+    whatever else might answer on the probed address.
+    """
+    try:
+        document = json.loads(body.decode('utf-8'))
+    except ValueError:
+        return False
+    return isinstance(document, dict) and 'DocumentIncarnation' in document
+
+
+async def _discover(timeout):
+    import discovery3
+    import retry
+
+    handler = discovery3.DhcpHandler()
+    handler.retry_policy = retry.DHCP_RETRY_POLICY.with_deadline(timeout)
+    try:
+        return await handler.discover_async()
+    except (discovery3.DhcpError, OSError):
+        return None
+
+
+def get_candidates(use_registry):
+    """
+    Return the distinct IP addresses worth probing, most specific first.
+    """
+    candidates = []
+    env_address = address.get_ip_address_reg_env(False)
+    reg_address = address.get_ip_address_reg_env(True) \
+        if use_registry and sys.platform == 'win32' else None
+    for candidate in (VNET_IP_ADDRESS, env_address, reg_address):
+        if candidate and candidate not in candidates:
+            candidates.append(candidate)
+    return candidates
+
+
+async def resolve_endpoint_async(ip_address=None, use_registry=False,
+                                 headers=None, use_dhcp=False,
+                                 timeout=PROBE_TIMEOUT, dhcp_timeout=5.0):
+    """
+    Return 'ip_address' if given and it answers a probe, else the cached
+    endpoint. Otherwise race the other sources and return the first valid
+    endpoint IP address, or None if no source produced one.
+    """
+    if ip_address:
+        # what the user asked for is not up for a race
+        if await probe(ip_address, headers, timeout):
+            return ip_address
+        logger.warning("%s does not serve scheduled events, trying the "
+                       "other sources", ip_address)
+    entry = endpoint_cache.load()
+    if entry is not None:
+        return entry['endpoint']
+    probes = set(asyncio.ensure_future(probe(candidate, headers, timeout))
+                 for candidate in get_candidates(use_registry))
+    pending = set(probes)
+    if use_dhcp:
+        # discovery records its result in the cache itself
+        pending.add(asyncio.ensure_future(_discover(dhcp_timeout)))
+
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED)
+            for source in done:
+                if source.exception() is None and source.result():
+                    if source in probes:
+                        endpoint_cache.store(
+                            source.result(),
+                            source=endpoint_cache.SOURCE_PROBE)
+                    return source.result()
+        return None
+    finally:
+        for source in pending:
+            source.cancel()
+        if pending:
+            await asyncio.wait(pending)
+
+
+def resolve_endpoint(ip_address=None, use_registry=False, headers=None,
+                     use_dhcp=False, timeout=PROBE_TIMEOUT):
+    """
+    Blocking wrapper around resolve_endpoint_async().
+    """
+    import discovery3
+    return discovery3.run_async(resolve_endpoint_async(
+        ip_address, use_registry, headers, use_dhcp, timeout))
@@ -0,0 +1,164 @@
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 3.5+
+
+"""
+Temporary firewall rule admitting DHCP replies on the client port.
+
+The firewall in use is detected once per discovery without spawning any
+process. The rule is added with a single exec (no shell) only when a
+packet filter is loaded, and removed again when discovery completes.
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+
+import log
+
+logger = log.get_logger('firewall')
+
+IPTABLES_RULE = ['INPUT', '-p', 'udp', '--dport', '68', '-j', 'ACCEPT']
+NFT_CHAIN = ['inet', 'filter', 'input']
+NFT_RULE = ['udp', 'dport', '68', 'accept']
+
+
+def _read_first_line(path):
+    try:
+        with open(path) as f:
+            return f.readline().strip()
+    except (IOError, OSError):
+        return ''
+
+
+def _exec(argv):
+    """
+    Run 'argv' without a shell. Returns the return code and stdout.
+    """
+    try:
+        proc = subprocess.run(argv, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL)
+    except OSError as e:
+        logger.warning("Unable to run %s: %s", argv[0], e)
+        return -1, ''
+    return proc.returncode, proc.stdout.decode('utf-8', 'replace')
+
+
+class DhcpFirewall(object):
+    """
+    Opens udp port 68 for the duration of a discovery.
+
+    Usable as a context manager; apply() and remove() are idempotent, and
+    only the first apply() after construction or remove() runs anything. A
+    rule that is already in place is left alone, and remove() only deletes
+    the rule this instance inserted.
+    """
+
+    def __init__(self):
+        self.backend = None
+        self.nft_handle = None
+        self.applied = False
+        self._detected = False
+        self._attempted = False
+
+    def detect(self):
+        """
+        Work out which packet filter, if any, needs the rule. Only inspects
+        /proc, /sys and PATH.
+        """
+        if self._detected:
+            return self.backend
+        self._detected = True
+        if not sys.platform.startswith('linux'):
+            return None
+
+        legacy = _read_first_line('/proc/net/ip_tables_names') != ''
+        nf_tables = os.path.isdir('/sys/module/nf_tables')
+        iptables = shutil.which('iptables')
+        nft = shutil.which('nft')
+        if iptables is not None and (legacy or nf_tables):
+            # covers both iptables-legacy and the iptables-nft wrapper
+            self.backend = ['iptables', iptables]
+        elif nft is not None and nf_tables:
+            self.backend = ['nft', nft]
+        return self.backend
+
+    def is_present(self):
+        """
+        Return True if the packet filter already accepts udp port 68 with
+        the same rule.
+        """
+        if self.detect() is None:
+            return False
+        name, path = self.backend
+        if name == 'iptables':
+            retcode, _ = _exec([path, '-w', '-C'] + IPTABLES_RULE)
+            return retcode == 0
+        retcode, out = _exec([path, 'list', 'chain'] + NFT_CHAIN)
+        rule = ' '.join(NFT_RULE)
+        return retcode == 0 and any(
+            line.split('#', 1)[0].strip() == rule
+            for line in out.splitlines())
+
+    def apply(self):
+        """
+        Insert the rule if a packet filter is active and does not have it
+        yet.
+        """
+        if self._attempted or self.detect() is None:
+            return
+        # a rule found in place or an insert that failed is not retried
+        self._attempted = True
+        if self.is_present():
+            logger.debug("Dhcp client port already open, no rule added")
+            return
+        name, path = self.backend
+        if name == 'iptables':
+            retcode, _ = _exec([path, '-w', '-I'] + IPTABLES_RULE)
+            self.applied = retcode == 0
+        else:
+            # --echo --handle reports the handle needed to delete the rule;
+            # this fails harmlessly when the chain does not exist.
+            retcode, out = _exec([path, '--echo', '--handle', 'insert',
+                                  'rule'] + NFT_CHAIN + NFT_RULE)
+            marker = '# handle '
+            if retcode == 0 and marker in out:
+                self.nft_handle = out.rsplit(marker, 1)[1].split()[0]
+                self.applied = True
+
+    def remove(self):
+        """
+        Delete the rule inserted by apply(), if it inserted one.
+        """
+        self._attempted = False
+        if not self.applied:
+            return
+        name, path = self.backend
+        if name == 'iptables':
+            _exec([path, '-w', '-D'] + IPTABLES_RULE)
+        else:
+            _exec([path, 'delete', 'rule'] + NFT_CHAIN +
+                  ['handle', self.nft_handle])
+        self.applied = False
+        self.nft_handle = None
+
+    def __enter__(self):
+        self.apply()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.remove()
+        return False
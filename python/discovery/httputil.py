@@ -0,0 +1,55 @@
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 3.5+
+
+"""
+urllib based requests to the Scheduled Events endpoint, with retries.
+"""
+
+import urllib.error
+import urllib.request
+
+import retry
+
+def is_permanent_http_error(error):
+    '''
+    Returns True for HTTP errors that retrying cannot fix.
+    '''
+    return (isinstance(error, urllib.error.HTTPError) and
+            error.code < 500 and error.code != 429)
+
+def urlopen_with_retry(request, retry_policy=None):
+    '''
+    Open the request, retrying transient failures according to retry_policy.
+    '''
+    if retry_policy is None:
+        retry_policy = retry.HTTP_RETRY_POLICY
+    return retry_policy.run(
+        lambda timeout: urllib.request.urlopen(request, timeout=timeout),
+        retry_on=(OSError,), giveup=is_permanent_http_error)
+
+def get_scheduled_events(address, headers, retry_policy=None):
+    '''
+    Make a GET request and return the response received.
+    '''
+    request = urllib.request.Request(address, headers=headers)
+    return urlopen_with_retry(request, retry_policy)
+
+def post_scheduled_events(address, data, headers, retry_policy=None):
+    '''
+    Make a POST request.
+    '''
+    request = urllib.request.Request(address, data=str.encode(data), headers=headers)
+    urlopen_with_retry(request, retry_policy)
@@ -0,0 +1,132 @@
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 3.5+
+
+"""
+Logging for the discovery modules.
+
+Modules log through get_logger() with %-style arguments, so a message is
+only formatted when a handler accepts it. Arguments that are expensive to
+compute, such as packet dumps, are wrapped in Lazy. Fields passed as
+'extra' stay on the record and are emitted by
+log_format.StructuredFormatter.
+
+The logging package itself is only imported once something needs it: until
+anyone has imported it, nobody can have configured it, so records below
+WARNING would be dropped anyway.
+"""
+
+import sys
+
+# Parent of every logger created by get_logger().
+ROOT_LOGGER = 'scheduledevents'
+
+# Same values as the logging package's levels.
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+_HAS_STACKLEVEL = sys.version_info >= (3, 8)
+
+
+class Logger(object):
+    """
+    Stands in for logging.getLogger(name) and loads it on first real use.
+    """
+
+    __slots__ = ('name', '_logger')
+
+    def __init__(self, name):
+        self.name = name
+        self._logger = None
+
+    def _get(self):
+        if self._logger is None:
+            import logging
+            self._logger = logging.getLogger(self.name)
+        return self._logger
+
+    def isEnabledFor(self, level):
+        if self._logger is None and level < WARNING and \
+                'logging' not in sys.modules:
+            return False
+        return self._get().isEnabledFor(level)
+
+    def _log(self, level, msg, args, kwargs):
+        if self.isEnabledFor(level):
+            if _HAS_STACKLEVEL:
+                # attribute the record to our caller, not to this class
+                kwargs.setdefault('stacklevel', 3)
+            self._get().log(level, msg, *args, **kwargs)
+
+    def log(self, level, msg, *args, **kwargs):
+        self._log(level, msg, args, kwargs)
+
+    def debug(self, msg, *args, **kwargs):
+        self._log(DEBUG, msg, args, kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        self._log(INFO, msg, args, kwargs)
+
+    def warning(self, msg, *args, **kwargs):
+        self._log(WARNING, msg, args, kwargs)
+
+    def error(self, msg, *args, **kwargs):
+        self._log(ERROR, msg, args, kwargs)
+
+
+def get_logger(name):
+    return Logger('{0}.{1}'.format(ROOT_LOGGER, name))
+
+
+class Lazy(object):
+    """
+    Log argument that calls func(*args) only when it is formatted.
+    """
+
+    __slots__ = ('func', 'args')
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        return str(self.func(*self.args))
+
+    __repr__ = __str__
+
+
+def configure(debug=False, structured=False, stream=None):
+    """
+    Send the discovery logs to 'stream' (stderr by default), at DEBUG level
+    with 'debug' and INFO otherwise, as JSON lines with 'structured'.
+    Replaces any handler installed by an earlier call.
+    """
+    import logging
+
+    logger = logging.getLogger(ROOT_LOGGER)
+    handler = logging.StreamHandler(stream or sys.stderr)
+    if structured:
+        import log_format
+        handler.setFormatter(log_format.StructuredFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+    for old in list(logger.handlers):
+        logger.removeHandler(old)
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG if debug else logging.INFO)
+    logger.propagate = False
+    return logger
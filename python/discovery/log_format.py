@@ -0,0 +1,48 @@
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 3.5+
+
+"""
+JSON lines output for the discovery logs, see log.configure().
+"""
+
+import json
+import logging
+
+# Attributes every LogRecord has; anything else came in through 'extra'.
+_RECORD_ATTRIBUTES = frozenset(
+    logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | \
+    frozenset(('message', 'asctime'))
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Formats each record as one JSON object per line, including the fields
+    passed as 'extra'.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for name, value in record.__dict__.items():
+            if name not in _RECORD_ATTRIBUTES:
+                entry[name] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
@@ -0,0 +1,444 @@
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 3.5+ on Linux
+
+"""
+Minimal rtnetlink client for enumerating links, addresses and routes.
+
+Each kind of object is fetched with a single dump request, however many
+interfaces there are; the kernel splits large dumps over several datagrams
+and they are read until NLMSG_DONE. Message layouts follow
+linux/netlink.h, linux/rtnetlink.h, linux/if_link.h and linux/if_addr.h.
+"""
+
+import os
+import socket
+import struct
+
+NETLINK_ROUTE = 0
+
+# struct nlmsghdr: length, type, flags, sequence number, port id
+NLMSG_HEADER = struct.Struct('=IHHII')
+NLMSG_NOOP = 1
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+
+NLM_F_REQUEST = 0x1
+NLM_F_MULTI = 0x2
+NLM_F_ACK = 0x4
+NLM_F_DUMP_INTR = 0x10
+NLM_F_DUMP = 0x300
+NLM_F_REPLACE = 0x100
+NLM_F_EXCL = 0x200
+NLM_F_CREATE = 0x400
+
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+RTM_NEWROUTE = 24
+RTM_DELROUTE = 25
+RTM_GETROUTE = 26
+
+# Multicast groups to subscribe to notifications.
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+
+# struct rtattr: length, type
+RTA_HEADER = struct.Struct('=HH')
+NLA_TYPE_MASK = 0x3FFF
+
+# struct ifinfomsg: family, type, index, flags, change
+IFINFOMSG = struct.Struct('=BxHiII')
+IFLA_ADDRESS = 1
+IFLA_IFNAME = 3
+IFF_UP = 0x1
+IFF_LOOPBACK = 0x8
+IFF_RUNNING = 0x40
+ARPHRD_ETHER = 1
+
+# struct ifaddrmsg: family, prefix length, flags, scope, index
+IFADDRMSG = struct.Struct('=BBBBI')
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_LABEL = 3
+
+# struct rtmsg: family, dst_len, src_len, tos, table, protocol, scope,
+# type, flags
+RTMSG = struct.Struct('=BBBBBBBBI')
+RTA_DST = 1
+RTA_OIF = 4
+RTA_GATEWAY = 5
+RTA_PRIORITY = 6
+RTA_TABLE = 15
+RT_TABLE_MAIN = 254
+RTPROT_BOOT = 3
+RTPROT_DHCP = 16
+RT_SCOPE_UNIVERSE = 0
+RT_SCOPE_LINK = 253
+RTN_UNICAST = 1
+
+U32 = struct.Struct('=I')
+
+# Dump replies are at most a few pages per datagram.
+RECV_BUFFER_SIZE = 1 << 16
+
+
+class NetlinkError(OSError):
+    """
+    The kernel answered a request with an error.
+    """
+
+
+def _align(length):
+    return (length + 3) & ~3
+
+
+def parse_attributes(view, offset=0):
+    """
+    Return the route attributes in view[offset:] as a dict of type to
+    value memoryview; the first attribute of each type wins.
+    """
+    attrs = {}
+    end = len(view)
+    while offset + RTA_HEADER.size <= end:
+        length, attr_type = RTA_HEADER.unpack_from(view, offset)
+        if length < RTA_HEADER.size or offset + length > end:
+            break
+        attr_type &= NLA_TYPE_MASK
+        if attr_type not in attrs:
+            attrs[attr_type] = view[offset + RTA_HEADER.size:offset + length]
+        offset += _align(length)
+    return attrs
+
+
+def pack_attribute(attr_type, value):
+    """
+    Encode one route attribute, padded to 4 bytes.
+    """
+    length = RTA_HEADER.size + len(value)
+    return RTA_HEADER.pack(length, attr_type) + bytes(value) + \
+        b'\0' * (_align(length) - length)
+
+
+def route_message(dst, dst_len, gateway=None, oif=None,
+                  table=RT_TABLE_MAIN, protocol=RTPROT_BOOT):
+    """
+    Encode the rtmsg and attributes of an IPv4 unicast route to 'dst' /
+    'dst_len'. Without a gateway the route is on the link of 'oif'.
+    """
+    scope = RT_SCOPE_UNIVERSE if gateway else RT_SCOPE_LINK
+    message = RTMSG.pack(socket.AF_INET, dst_len, 0, 0, table, protocol,
+                         scope, RTN_UNICAST, 0)
+    if dst_len:
+        message += pack_attribute(RTA_DST, socket.inet_aton(dst))
+    if gateway:
+        message += pack_attribute(RTA_GATEWAY, socket.inet_aton(gateway))
+    if oif is not None:
+        message += pack_attribute(RTA_OIF, U32.pack(oif))
+    return message
+
+
+def _ip(family, value):
+    if value is None:
+        return None
+    return socket.inet_ntop(family, bytes(value))
+
+
+def _string(value):
+    if value is None:
+        return None
+    return bytes(value).split(b'\0', 1)[0].decode('utf-8', 'replace')
+
+
+class Link(object):
+    """
+    A network interface from an RTM_NEWLINK message.
+    """
+
+    __slots__ = ('index', 'name', 'flags', 'type', 'mac')
+
+    def __init__(self, index, name, flags, link_type, mac):
+        self.index = index
+        self.name = name
+        self.flags = flags
+        self.type = link_type
+        self.mac = mac
+
+    @classmethod
+    def from_payload(cls, payload):
+        _, link_type, index, flags, _ = IFINFOMSG.unpack_from(payload)
+        attrs = parse_attributes(payload, IFINFOMSG.size)
+        mac = attrs.get(IFLA_ADDRESS)
+        return cls(index, _string(attrs.get(IFLA_IFNAME)), flags, link_type,
+                   bytearray(mac) if mac is not None else None)
+
+    @property
+    def is_up(self):
+        return bool(self.flags & IFF_UP)
+
+    @property
+    def is_loopback(self):
+        return bool(self.flags & IFF_LOOPBACK)
+
+    def __repr__(self):
+        return 'Link(index={0}, name={1!r}, flags={2:#x}, type={3})'.format(
+            self.index, self.name, self.flags, self.type)
+
+
+class Address(object):
+    """
+    An interface address from an RTM_NEWADDR message.
+    """
+
+    __slots__ = ('index', 'family', 'prefixlen', 'address', 'label')
+
+    def __init__(self, index, family, prefixlen, address, label=None):
+        self.index = index
+        self.family = family
+        self.prefixlen = prefixlen
+        self.address = address
+        self.label = label
+
+    @classmethod
+    def from_payload(cls, payload):
+        family, prefixlen, _, _, index = IFADDRMSG.unpack_from(payload)
+        attrs = parse_attributes(payload, IFADDRMSG.size)
+        # IFA_LOCAL is the interface's own address on point to point links
+        value = attrs.get(IFA_LOCAL, attrs.get(IFA_ADDRESS))
+        return cls(index, family, prefixlen, _ip(family, value),
+                   _string(attrs.get(IFA_LABEL)))
+
+    def __repr__(self):
+        return 'Address(index={0}, address={1}/{2})'.format(
+            self.index, self.address, self.prefixlen)
+
+
+class Route(object):
+    """
+    A route from an RTM_NEWROUTE message. 'dst' is None for the default
+    route, 'priority' is the metric.
+    """
+
+    __slots__ = ('family', 'dst', 'dst_len', 'gateway', 'oif', 'priority',
+                 'table', 'protocol', 'scope', 'type')
+
+    def __init__(self, family, dst, dst_len, gateway=None, oif=None,
+                 priority=0, table=RT_TABLE_MAIN, protocol=RTPROT_BOOT,
+                 scope=RT_SCOPE_UNIVERSE, route_type=RTN_UNICAST):
+        self.family = family
+        self.dst = dst
+        self.dst_len = dst_len
+        self.gateway = gateway
+        self.oif = oif
+        self.priority = priority
+        self.table = table
+        self.protocol = protocol
+        self.scope = scope
+        self.type = route_type
+
+    @classmethod
+    def from_payload(cls, payload):
+        family, dst_len, _, _, table, protocol, scope, route_type, _ = \
+            RTMSG.unpack_from(payload)
+        attrs = parse_attributes(payload, RTMSG.size)
+        if RTA_TABLE in attrs:
+            table = U32.unpack(attrs[RTA_TABLE])[0]
+        oif = attrs.get(RTA_OIF)
+        priority = attrs.get(RTA_PRIORITY)
+        return cls(family, _ip(family, attrs.get(RTA_DST)), dst_len,
+                   _ip(family, attrs.get(RTA_GATEWAY)),
+                   U32.unpack(oif)[0] if oif is not None else None,
+                   U32.unpack(priority)[0] if priority is not None else 0,
+                   table, protocol, scope, route_type)
+
+    @property
+    def is_default(self):
+        return self.dst_len == 0
+
+    def __repr__(self):
+        return 'Route(dst={0}/{1}, gateway={2}, oif={3}, priority={4})'.format(
+            self.dst or '0.0.0.0', self.dst_len, self.gateway, self.oif,
+            self.priority)
+
+
+class NetlinkSocket(object):
+    """
+    A NETLINK_ROUTE socket. 'groups' subscribes to notifications.
+
+    Payloads handed out by messages() and dump() are views into a buffer
+    that is reused by the next receive, decode them before asking for more.
+    """
+
+    def __init__(self, groups=0):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                                  NETLINK_ROUTE)
+        try:
+            self.sock.bind((0, groups))
+        except OSError:
+            self.sock.close()
+            raise
+        self.seq = 0
+        self.buf = bytearray(RECV_BUFFER_SIZE)
+
+    def close(self):
+        self.sock.close()
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def send(self, msg_type, payload, flags=NLM_F_REQUEST):
+        """
+        Send one message; returns its sequence number.
+        """
+        self.seq += 1
+        header = NLMSG_HEADER.pack(NLMSG_HEADER.size + len(payload),
+                                   msg_type, flags, self.seq, 0)
+        self.sock.sendto(header + bytes(payload), (0, 0))
+        return self.seq
+
+    def messages(self):
+        """
+        Receive one datagram and yield the (type, flags, seq, payload) of
+        each message in it.
+        """
+        size = self.sock.recv_into(self.buf)
+        view = memoryview(self.buf)[:size]
+        offset = 0
+        while offset + NLMSG_HEADER.size <= size:
+            length, msg_type, flags, seq, _ = \
+                NLMSG_HEADER.unpack_from(view, offset)
+            if length < NLMSG_HEADER.size or offset + length > size:
+                break
+            yield msg_type, flags, seq, view[offset + NLMSG_HEADER.size:
+                                             offset + length]
+            offset += _align(length)
+
+    def _error(self, payload):
+        errno = -struct.unpack_from('=i', payload)[0]
+        if errno:
+            return NetlinkError(errno, os.strerror(errno))
+        return None
+
+    def dump(self, msg_type, payload):
+        """
+        Send a dump request and yield the (type, payload) of every reply.
+        """
+        seq = self.send(msg_type, payload, NLM_F_REQUEST | NLM_F_DUMP)
+        while True:
+            for reply_type, _, reply_seq, reply in self.messages():
+                if reply_seq != seq:
+                    # a notification or a late answer to something else
+                    continue
+                if reply_type == NLMSG_DONE:
+                    return
+                if reply_type == NLMSG_ERROR:
+                    error = self._error(reply)
+                    if error is not None:
+                        raise error
+                    return
+                yield reply_type, reply
+
+    def request(self, msg_type, payload, flags=0):
+        """
+        Send a request that changes kernel state and wait for its ack.
+        Raises NetlinkError if the kernel refused it.
+        """
+        error = self.batch([(msg_type, payload, flags)])[0]
+        if error is not None:
+            raise error
+
+    def batch(self, requests):
+        """
+        Send (type, payload, flags) requests that change kernel state in a
+        single datagram and wait for all of their acks. The kernel handles
+        them in order and carries on past a refused one; returns None or
+        the NetlinkError of each request.
+        """
+        chunks = []
+        pending = {}
+        for position, (msg_type, payload, flags) in enumerate(requests):
+            self.seq += 1
+            pending[self.seq] = position
+            chunks.append(NLMSG_HEADER.pack(
+                NLMSG_HEADER.size + len(payload), msg_type,
+                NLM_F_REQUEST | NLM_F_ACK | flags, self.seq, 0))
+            chunks.append(bytes(payload))
+        results = [None] * len(pending)
+        if not pending:
+            return results
+        self.sock.sendto(b''.join(chunks), (0, 0))
+        while pending:
+            for reply_type, _, reply_seq, reply in self.messages():
+                if reply_type == NLMSG_ERROR and reply_seq in pending:
+                    results[pending.pop(reply_seq)] = self._error(reply)
+        return results
+
+
+def _dump(sock, msg_type, payload, cls):
+    if sock is None:
+        with NetlinkSocket() as sock:
+            return _dump(sock, msg_type, payload, cls)
+    return [cls.from_payload(reply)
+            for reply_type, reply in sock.dump(msg_type, payload)
+            if reply_type == msg_type - 2]
+
+
+def get_links(sock=None):
+    """
+    Return every network interface as a Link, in one RTM_GETLINK dump.
+    """
+    return _dump(sock, RTM_GETLINK,
+                 IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0), Link)
+
+
+def get_addresses(family=socket.AF_INET, sock=None):
+    """
+    Return every address of 'family' as an Address, in one RTM_GETADDR
+    dump.
+    """
+    return _dump(sock, RTM_GETADDR, IFADDRMSG.pack(family, 0, 0, 0, 0),
+                 Address)
+
+
+def get_routes(family=socket.AF_INET, table=RT_TABLE_MAIN, sock=None):
+    """
+    Return the unicast routes of 'family' in 'table' as Routes, in one
+    RTM_GETROUTE dump.
+    """
+    routes = _dump(sock, RTM_GETROUTE,
+                   RTMSG.pack(family, 0, 0, 0, 0, 0, 0, 0, 0), Route)
+    return [route for route in routes
+            if route.table == table and route.type == RTN_UNICAST]
+
+
+def get_default_routes(family=socket.AF_INET, sock=None):
+    """
+    Return the default routes of the main table, lowest metric first.
+    """
+    routes = [route for route in get_routes(family, sock=sock)
+              if route.is_default]
+    routes.sort(key=lambda route: route.priority)
+    return routes
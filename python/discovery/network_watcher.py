@@ -0,0 +1,217 @@
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 3.5+ on Linux
+
+"""
+Watches the network configuration the discovery result depends on.
+
+The watcher subscribes to rtnetlink link, IPv4 address and IPv4 route
+notifications and sleeps until one arrives. Notifications about the primary
+interface, its addresses or a default route start a short settle period, so
+a burst such as a DHCP renewal is handled once. The period is counted from
+the first notification and later ones do not extend it, so a steady stream
+of notifications cannot hold the check back. The state is then read back
+and the callback only runs if the primary interface, its MAC address, its
+IPv4 addresses or the default gateway actually differ.
+"""
+
+import errno
+import select
+import socket
+import time
+
+import log
+import netlink
+
+logger = log.get_logger('network_watcher')
+
+GROUPS = netlink.RTMGRP_LINK | netlink.RTMGRP_IPV4_IFADDR | \
+    netlink.RTMGRP_IPV4_ROUTE
+
+# Seconds from the first relevant notification until the state is read.
+DEFAULT_SETTLE = 1.0
+
+# Room for a burst of notifications while the callback runs.
+RECEIVE_BUFFER = 1 << 20
+
+
+class NetworkState(object):
+    """
+    The primary interface (the one with the lowest-metric default route),
+    its MAC address and IPv4 addresses, and the default gateway.
+    """
+
+    __slots__ = ('index', 'name', 'mac', 'addresses', 'gateway')
+
+    def __init__(self, index=None, name=None, mac=None, addresses=(),
+                 gateway=None):
+        self.index = index
+        self.name = name
+        self.mac = mac
+        self.addresses = tuple(sorted(addresses))
+        self.gateway = gateway
+
+    @classmethod
+    def capture(cls):
+        """
+        Read the current state with one dump of each kind.
+        """
+        with netlink.NetlinkSocket() as sock:
+            routes = [route for route in netlink.get_default_routes(sock=sock)
+                      if route.oif is not None]
+            if not routes:
+                return cls()
+            index = routes[0].oif
+            link = None
+            for candidate in netlink.get_links(sock):
+                if candidate.index == index:
+                    link = candidate
+                    break
+            if link is None or not link.is_up:
+                return cls()
+            addresses = ['{0}/{1}'.format(address.address, address.prefixlen)
+                         for address in netlink.get_addresses(socket.AF_INET,
+                                                              sock)
+                         if address.index == index]
+        return cls(index, link.name, bytes(link.mac or b''), addresses,
+                   routes[0].gateway)
+
+    @property
+    def is_connected(self):
+        return self.index is not None and bool(self.addresses)
+
+    def _key(self):
+        return (self.index, self.name, self.mac, self.addresses, self.gateway)
+
+    def __eq__(self, other):
+        return isinstance(other, NetworkState) and self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'NetworkState(name={0!r}, addresses={1!r}, gateway={2!r})' \
+            .format(self.name, list(self.addresses), self.gateway)
+
+
+class NetworkWatcher(object):
+    """
+    Calls on_change(old, new) with the previous and current NetworkState
+    whenever the state changes. run() blocks until stop() is called, from
+    the callback or from another thread.
+    """
+
+    def __init__(self, on_change, settle=DEFAULT_SETTLE):
+        self.on_change = on_change
+        self.settle = settle
+        self.state = None
+        self.sock = netlink.NetlinkSocket(GROUPS)
+        try:
+            self.sock.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                      RECEIVE_BUFFER)
+        except OSError:
+            pass
+        self._wakeup, self._waker = socket.socketpair()
+        self._stopped = False
+
+    def close(self):
+        self.sock.close()
+        self._wakeup.close()
+        self._waker.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def stop(self):
+        self._stopped = True
+        try:
+            self._waker.send(b'\0')
+        except OSError:
+            pass
+
+    def is_relevant(self, msg_type, payload):
+        """
+        Return True if a notification may change the NetworkState.
+        """
+        if msg_type in (netlink.RTM_NEWROUTE, netlink.RTM_DELROUTE):
+            route = netlink.Route.from_payload(payload)
+            return route.is_default and route.table == netlink.RT_TABLE_MAIN
+        index = self.state.index if self.state is not None else None
+        if index is None:
+            return False
+        if msg_type in (netlink.RTM_NEWLINK, netlink.RTM_DELLINK):
+            return netlink.Link.from_payload(payload).index == index
+        if msg_type in (netlink.RTM_NEWADDR, netlink.RTM_DELADDR):
+            return netlink.Address.from_payload(payload).index == index
+        return False
+
+    def _receive(self):
+        """
+        Read one datagram of notifications; returns True if any of them is
+        relevant, or if notifications were lost.
+        """
+        relevant = False
+        try:
+            for msg_type, _, _, payload in self.sock.messages():
+                if not relevant and self.is_relevant(msg_type, payload):
+                    logger.debug('Relevant netlink notification %s', msg_type)
+                    relevant = True
+        except OSError as e:
+            if e.errno != errno.ENOBUFS:
+                raise
+            logger.warning('Netlink notifications were lost, rechecking')
+            relevant = True
+        return relevant
+
+    def check(self):
+        """
+        Read the state and call on_change if it differs from the last one.
+        """
+        try:
+            state = NetworkState.capture()
+        except OSError as e:
+            logger.warning('Unable to read the network state: %s', e)
+            return
+        if state == self.state:
+            logger.debug('Network state unchanged: %s', state)
+            return
+        old, self.state = self.state, state
+        logger.info('Network state changed from %s to %s', old, state)
+        self.on_change(old, state)
+
+    def run(self):
+        """
+        Wait for notifications until stop() is called.
+        """
+        self.state = NetworkState.capture()
+        logger.debug('Watching %s', self.state)
+        deadline = None
+        while not self._stopped:
+            timeout = None
+            if deadline is not None:
+                timeout = max(0.0, deadline - time.monotonic())
+            readable, _, _ = select.select([self.sock, self._wakeup], [], [],
+                                           timeout)
+            if self._wakeup in readable:
+                break
+            if self.sock in readable and self._receive() and deadline is None:
+                deadline = time.monotonic() + self.settle
+            if deadline is not None and time.monotonic() >= deadline:
+                deadline = None
+                self.check()
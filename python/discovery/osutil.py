@@ -0,0 +1,249 @@
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 3.5+
+
+"""
+Operating system helpers for discovery: interfaces, routes, MAC address,
+firewall and shell commands. Modules only some of them need are imported on use.
+"""
+
+import socket
+import struct
+
+import log
+import netlink
+
+logger = log.get_logger('osutil')
+
+""" 
+Shell command util functions 
+""" 
+def run(cmd, chk_err=True): 
+    """ 
+    Calls run_get_output on 'cmd', returning only the return code. 
+    If chk_err=True then errors will be reported in the log. 
+    If chk_err=False then errors will be suppressed from the log. 
+    """ 
+    retcode,out=run_get_output(cmd,chk_err) 
+    return retcode 
+ 
+def run_get_output(cmd, chk_err=True, log_cmd=False): 
+    """ 
+    Wrapper for subprocess.check_output. 
+    Execute 'cmd'.  Returns return code and STDOUT, trapping expected exceptions. 
+    Reports exceptions to Error if chk_err parameter is True 
+    """ 
+    if log_cmd: 
+        logger.info("run cmd '%s'", cmd)
+    import subprocess
+    try: 
+        output=subprocess.check_output(cmd,stderr=subprocess.STDOUT,shell=True) 
+        output = output.decode('utf-8', errors="backslashreplace")
+    except subprocess.CalledProcessError as e : 
+        output = e.output.decode('utf-8', errors="backslashreplace")
+        if chk_err: 
+            if log_cmd: 
+                logger.error("run cmd '%s' failed", e.cmd)
+            logger.error("Error Code:%s", e.returncode)
+            logger.error("Result:%s", output)
+        return e.returncode, output  
+    return 0, output
+
+# End shell command util functions 
+
+class DefaultOSUtil(object):
+
+    def get_mac_in_bytes(self):
+        from uuid import getnode as get_mac
+        mac = get_mac()
+        machex = '%012x' % mac
+        macb = bytearray.fromhex(machex)
+        return macb
+        
+    def allow_dhcp_broadcast(self):
+        """
+        Open the DHCP client port if a packet filter is active.
+        Returns the firewall.DhcpFirewall to remove() once discovery is done.
+        """
+        import firewall
+        dhcp_firewall = firewall.DhcpFirewall()
+        dhcp_firewall.apply()
+        return dhcp_firewall
+
+    def get_interfaces(self):
+        """
+        Return (name, mac address) of every up, non-loopback ethernet
+        interface, in interface index order.
+        """
+        interfaces = []
+        for link in sorted(netlink.get_links(), key=lambda link: link.index):
+            if link.is_loopback or not link.is_up or \
+                    link.type != netlink.ARPHRD_ETHER or \
+                    link.mac is None or len(link.mac) != 6:
+                continue
+            interfaces.append((link.name, link.mac))
+        return interfaces
+
+    def get_first_if(self):
+        """
+        Return the interface name, and ip addr of the primary interface,
+        or of the first active non-loopback interface with an IPv4
+        address if there is no default route.
+        """
+        with netlink.NetlinkSocket() as sock:
+            links = dict((link.index, link)
+                         for link in netlink.get_links(sock))
+            addresses = netlink.get_addresses(socket.AF_INET, sock)
+            primary = self._primary_index(sock)
+        candidates = [primary] if primary in links else \
+            sorted(index for index, link in links.items()
+                   if link.is_up and not link.is_loopback)
+        for index in candidates:
+            for address in addresses:
+                if address.index == index:
+                    logger.debug('interface [%s] selected',
+                                 links[index].name)
+                    return links[index].name, address.address
+        logger.debug('no interface with an IPv4 address found')
+        return '', '0.0.0.0'
+
+    def _primary_index(self, sock=None):
+        routes = [route for route in netlink.get_default_routes(sock=sock)
+                  if route.oif is not None]
+        return routes[0].oif if routes else None
+
+    def get_primary_interface(self):
+        """
+        Get the name of the primary interface, which is the one with the
+        default route attached to it; if there are multiple default routes,
+        the primary has the lowest Metric.
+        :return: the interface which has the default route
+        """
+        primary = ''
+        with netlink.NetlinkSocket() as sock:
+            index = self._primary_index(sock)
+            if index is not None:
+                for link in netlink.get_links(sock):
+                    if link.index == index:
+                        primary = link.name
+                        break
+        logger.debug('primary interface is [%s]', primary)
+        return primary
+
+    def is_loopback(self, ifname):
+        if isinstance(ifname, (bytes, bytearray)):
+            ifname = ifname.decode('utf-8', 'replace')
+        for link in netlink.get_links():
+            if link.name == ifname:
+                logger.debug('interface [%s] has flags [%#x], is loopback [%s]',
+                             ifname, link.flags, link.is_loopback)
+                return link.is_loopback
+        return False
+
+    def get_ip4_addr(self):
+        return self.get_first_if()[1]
+
+    def start_network(self):
+        pass
+
+    def _interface_index(self, interface, sock):
+        if interface is None:
+            return self._primary_index(sock)
+        for link in netlink.get_links(sock):
+            if link.name == interface:
+                return link.index
+        return None
+
+    def add_routes(self, routes, interface=None):
+        """
+        Install the (net, mask, gateway) routes from option 249 that are not
+        in the main routing table yet, all in a single netlink datagram.
+        A gateway of 0 puts the network on the link of 'interface', the
+        primary interface by default. Addresses are dotted strings or
+        integers. Returns the routes that were added.
+        """
+        return self._add_routes(routes, interface)[0]
+
+    def _add_routes(self, routes, interface):
+        # returns the routes added and the routes that could not be added;
+        # the routes already present are in neither
+        failed = []
+        with netlink.NetlinkSocket() as sock:
+            existing = {}
+            for route in netlink.get_routes(socket.AF_INET, sock=sock):
+                existing.setdefault((route.dst or '0.0.0.0', route.dst_len),
+                                    set()).add(route.gateway)
+            index = self._interface_index(interface, sock)
+            missing = []
+            for net, mask, gateway in routes:
+                dst = _ip4_str(net)
+                dst_len = bin(_ip4_int(mask)).count('1')
+                via = _ip4_str(gateway) if _ip4_int(gateway) else None
+                gateways = existing.get((dst, dst_len))
+                if gateways is not None:
+                    if via not in gateways:
+                        logger.warning('Route to %s/%d via %s conflicts with '
+                                       'an existing route, skipped',
+                                       dst, dst_len, via or 'link')
+                        failed.append((net, mask, gateway))
+                    continue
+                if via is None and index is None:
+                    logger.warning('No interface for on-link route to %s/%d',
+                                   dst, dst_len)
+                    failed.append((net, mask, gateway))
+                    continue
+                existing[(dst, dst_len)] = set([via])
+                missing.append(((net, mask, gateway), (dst, dst_len, via),
+                                netlink.route_message(
+                                    dst, dst_len, via,
+                                    index if via is None else None,
+                                    protocol=netlink.RTPROT_DHCP)))
+            logger.debug('%d of %d routes missing', len(missing), len(routes))
+            errors = sock.batch([(netlink.RTM_NEWROUTE, message,
+                                  netlink.NLM_F_CREATE | netlink.NLM_F_EXCL)
+                                 for _, _, message in missing])
+        added = []
+        for (route, (dst, dst_len, via), _), error in zip(missing, errors):
+            if error is not None:
+                logger.warning('Unable to add route to %s/%d via %s: %s',
+                               dst, dst_len, via or 'link', error)
+                failed.append(route)
+            else:
+                added.append(route)
+        return added, failed
+
+    def route_add(self, net, mask, gateway):
+        """
+        Add the specified route, see add_routes(). Returns 0 if the route
+        was added or is already present, 1 if it could not be added.
+        """
+        try:
+            failed = self._add_routes([(net, mask, gateway)], None)[1]
+        except OSError as e:
+            logger.warning('Unable to add route to %s: %s', net, e)
+            return 1
+        return 1 if failed else 0
+
+
+def _ip4_int(value):
+    if isinstance(value, int):
+        return value
+    return struct.unpack('!I', socket.inet_aton(value))[0]
+
+
+def _ip4_str(value):
+    if isinstance(value, int):
+        return socket.inet_ntoa(struct.pack('!I', value))
+    return value
@@ -0,0 +1,222 @@
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 3.5+
+
+"""
+Publishes the discovered endpoint where other programs can find it.
+
+Each sink compares the value it already holds before writing, so running
+discovery again with an unchanged endpoint writes nothing. Files are
+dedicated drop-ins replaced atomically: the new content is written to a
+temporary file in the same directory and renamed over the old one.
+"""
+
+import os
+import sys
+
+import log
+
+logger = log.get_logger('publisher')
+
+ENV_VAR = 'SCHEDULEDEVENTSIP'
+
+# Sourced by login shells.
+PROFILE_DROP_IN = '/etc/profile.d/scheduledevents.sh'
+# Read by the systemd user manager.
+ENVIRONMENT_DROP_IN = '/etc/environment.d/90-scheduledevents.conf'
+# Older versions appended the export to this file.
+LEGACY_PROFILE = '/etc/profile'
+
+REGISTRY_KEY = 'Software\\ScheduledEvents'
+REGISTRY_VALUE = 'ScheduledEventsIp'
+MACHINE_ENVIRONMENT_KEY = \
+    'SYSTEM\\CurrentControlSet\\Control\\Session Manager\\Environment'
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
+def write_atomic(path, content, mode=None):
+    """
+    Replace 'path' with 'content' unless it already holds exactly that.
+    Readers see either the old or the new file, never a partial one. The
+    file keeps its permissions; new files get 'mode', 0644 by default.
+    Returns True if the file was written.
+    """
+    if _read(path) == content:
+        return False
+    if mode is None:
+        try:
+            mode = os.stat(path).st_mode & 0o7777
+        except OSError:
+            mode = 0o644
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+    try:
+        with open(tmp, 'w') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except (IOError, OSError):
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    return True
+
+
+class FileSink(object):
+    """
+    Keeps the variable in a drop-in file rendered from 'line_format',
+    e.g. 'export {0}={1}\\n'.
+    """
+
+    def __init__(self, path, line_format):
+        self.path = path
+        self.line_format = line_format
+
+    def publish(self, name, value):
+        return write_atomic(self.path, self.line_format.format(name, value))
+
+
+class ProfileSink(FileSink):
+    """
+    Exports the variable to login shells from /etc/profile.d, removing the
+    line older versions appended to /etc/profile.
+    """
+
+    def __init__(self, path=PROFILE_DROP_IN, legacy_path=LEGACY_PROFILE):
+        FileSink.__init__(self, path, 'export {0}={1}\n')
+        self.legacy_path = legacy_path
+
+    def publish(self, name, value):
+        changed = FileSink.publish(self, name, value)
+        return remove_legacy_export(name, self.legacy_path) or changed
+
+
+class ProcessEnvSink(object):
+    """
+    Sets the variable in the environment of this process and its children.
+    """
+
+    def publish(self, name, value):
+        if os.environ.get(name) == value:
+            return False
+        os.environ[name] = value
+        return True
+
+
+class MachineEnvSink(object):
+    """
+    Sets a system wide environment variable on Windows with SETX /M.
+    """
+
+    def publish(self, name, value):
+        import winreg
+        try:
+            with winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE,
+                                MACHINE_ENVIRONMENT_KEY) as key:
+                if winreg.QueryValueEx(key, name)[0] == value:
+                    return False
+        except OSError:
+            pass
+        import subprocess
+        retcode = subprocess.run(['SETX', name, value, '/M']).returncode
+        if retcode != 0:
+            raise OSError('SETX exited with {0}'.format(retcode))
+        return True
+
+
+class RegistrySink(object):
+    """
+    Stores the endpoint as a registry value under HKEY_LOCAL_MACHINE.
+    """
+
+    def __init__(self, key=REGISTRY_KEY, value_name=REGISTRY_VALUE):
+        self.key = key
+        self.value_name = value_name
+
+    def publish(self, name, value):
+        import winreg
+        with winreg.CreateKey(winreg.HKEY_LOCAL_MACHINE, self.key) as key:
+            try:
+                if winreg.QueryValueEx(key, self.value_name)[0] == value:
+                    return False
+            except OSError:
+                pass
+            winreg.SetValueEx(key, self.value_name, 0, winreg.REG_SZ, value)
+        return True
+
+
+def remove_legacy_export(name=ENV_VAR, path=LEGACY_PROFILE):
+    """
+    Drop the 'export NAME=' line older versions appended to /etc/profile,
+    which would otherwise override the drop-in. Returns True if the file
+    was rewritten.
+    """
+    content = _read(path)
+    match = 'export {0}='.format(name)
+    if content is None or match not in content:
+        return False
+    lines = content.splitlines(True)
+    return write_atomic(path, ''.join(line for line in lines
+                                      if match not in line))
+
+
+def default_sinks(environment=True, registry=False):
+    """
+    Return the sinks for this platform: the process and system wide
+    environment with 'environment', the registry value with 'registry'.
+    """
+    sinks = []
+    if environment:
+        sinks.append(ProcessEnvSink())
+        if sys.platform == 'win32':
+            sinks.append(MachineEnvSink())
+        elif sys.platform.startswith('linux'):
+            sinks.append(ProfileSink())
+            if os.path.isdir('/run/systemd/system'):
+                sinks.append(FileSink(ENVIRONMENT_DROP_IN, '{0}={1}\n'))
+    if registry and sys.platform == 'win32':
+        sinks.append(RegistrySink())
+    return sinks
+
+
+def publish(value, sinks, name=ENV_VAR):
+    """
+    Hand 'value' to every sink. Returns the sinks that changed; a failing
+    sink is logged and does not stop the others.
+    """
+    changed = []
+    for sink in sinks:
+        try:
+            if sink.publish(name, value):
+                changed.append(sink)
+        except (IOError, OSError) as e:
+            logger.warning("Unable to publish %s with %s: %s", name,
+                           type(sink).__name__, e)
+    logger.debug("Published %s=%s, %d of %d sinks changed", name, value,
+                 len(changed), len(sinks))
+    return changed
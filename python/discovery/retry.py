@@ -0,0 +1,125 @@
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 3.5+
+
+"""
+Deadline-driven retry policy shared by DHCP discovery and the HTTP calls.
+
+Every attempt gets a time slot: the attempt's timeout. Slots start short
+and grow exponentially with jitter, and no slot extends past the overall
+deadline. A failed attempt waits for the end of its slot before the next
+one starts, and nothing waits after the last attempt.
+"""
+
+import random
+import time
+
+
+class RetryPolicy(object):
+    """
+    timeouts: the first attempt timeouts in seconds. Later attempts multiply
+              the last one by 'multiplier', up to 'max_timeout'.
+    jitter: each timeout is scaled by a random factor in [1 - jitter, 1 + jitter].
+    deadline: total budget in seconds across all attempts.
+    max_attempts: optional limit on the number of attempts.
+    """
+
+    def __init__(self, timeouts=(0.2, 0.5, 1.0), multiplier=2.0,
+                 max_timeout=4.0, jitter=0.1, deadline=15.0,
+                 max_attempts=None):
+        if not timeouts:
+            raise ValueError("At least one timeout is required")
+        self.timeouts = tuple(timeouts)
+        self.multiplier = multiplier
+        self.max_timeout = max_timeout
+        self.jitter = jitter
+        self.deadline = deadline
+        self.max_attempts = max_attempts
+
+    def with_deadline(self, deadline):
+        """
+        Return a copy of this policy with another overall deadline.
+        """
+        return RetryPolicy(self.timeouts, self.multiplier, self.max_timeout,
+                           self.jitter, deadline, self.max_attempts)
+
+    def timeout(self, attempt):
+        """
+        Return the jittered timeout of the zero based 'attempt'.
+        """
+        if attempt < len(self.timeouts):
+            timeout = self.timeouts[attempt]
+        else:
+            # the exponent is bounded, the result is capped anyway
+            extra = min(attempt - len(self.timeouts) + 1, 64)
+            timeout = min(self.timeouts[-1] * self.multiplier ** extra,
+                          self.max_timeout)
+        if self.jitter:
+            timeout *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return timeout
+
+    def attempts(self, clock=time.monotonic):
+        """
+        Yield the timeout of each attempt, clipped to the remaining budget,
+        until the deadline passes or max_attempts is reached.
+        """
+        end = clock() + self.deadline
+        attempt = 0
+        while self.max_attempts is None or attempt < self.max_attempts:
+            remaining = end - clock()
+            if remaining <= 0:
+                return
+            yield min(self.timeout(attempt), remaining)
+            attempt += 1
+
+    def _last_attempt(self, attempt, slot_end, end):
+        return slot_end >= end or (self.max_attempts is not None and
+                                   attempt + 1 >= self.max_attempts)
+
+    def run(self, func, retry_on=(Exception,), giveup=None,
+            clock=time.monotonic, sleep=time.sleep):
+        """
+        Call func(timeout) until it returns. Exceptions in 'retry_on' are
+        retried unless giveup(exception) is true; the last one is raised
+        once the budget is spent.
+        """
+        end = clock() + self.deadline
+        attempt = 0
+        while True:
+            start = clock()
+            timeout = min(self.timeout(attempt), max(end - start, 0))
+            try:
+                return func(timeout)
+            except retry_on as e:
+                if (giveup is not None and giveup(e)) or \
+                        self._last_attempt(attempt, start + timeout, end):
+                    raise
+            wait = start + timeout - clock()
+            if wait > 0:
+                sleep(wait)
+            attempt += 1
+
+
+# Discovery: the DHCP server normally answers within a few milliseconds.
+DHCP_RETRY_POLICY = RetryPolicy(timeouts=(0.2, 0.5, 1.0), max_timeout=4.0,
+                                deadline=15.0)
+
+# Requests to the scheduled events endpoint.
+HTTP_RETRY_POLICY = RetryPolicy(timeouts=(0.5, 1.0, 2.0), max_timeout=5.0,
+                                deadline=10.0)
+
+# Cheap checks of whether an address serves scheduled events at all.
+PROBE_RETRY_POLICY = RetryPolicy(timeouts=(0.5, 1.0), deadline=2.0,
+                                 max_attempts=2)
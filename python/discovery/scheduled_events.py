@@ -0,0 +1,626 @@
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 3.5+
+
+"""
+Client for the Scheduled Events endpoint over a persistent HTTP connection.
+"""
+
+import http.client
+import json
+import random
+import re
+import sys
+import time
+from urllib.parse import urlparse
+
+import retry
+
+
+class ScheduledEventsError(Exception):
+    """
+    The endpoint answered with an HTTP error status.
+    """
+
+    def __init__(self, status, reason, body=b''):
+        super(ScheduledEventsError, self).__init__(
+            u"HTTP {0} {1}".format(status, reason))
+        self.status = status
+        self.reason = reason
+        self.body = body
+
+    def is_transient(self):
+        return self.status >= 500 or self.status == 429
+
+
+def is_permanent_error(error):
+    """
+    Returns True for errors that retrying cannot fix.
+    """
+    return isinstance(error, ScheduledEventsError) and not error.is_transient()
+
+
+def _merge_headers(headers, extra):
+    """
+    Return 'headers' updated with 'extra'. Header names are compared
+    without regard to case, so that a caller's 'metadata' replaces the
+    default 'Metadata' instead of being sent alongside it.
+    """
+    merged = dict(headers)
+    for name, value in extra.items():
+        for existing in [key for key in merged
+                         if key.lower() == name.lower()]:
+            del merged[existing]
+        merged[name] = value
+    return merged
+
+
+class ScheduledEventsClient(object):
+    """
+    Issues GET and POST requests to one Scheduled Events address, keeping the
+    connection open between requests.
+
+    A failed request drops the connection and the next attempt reconnects.
+    A request that fails on a reused connection, which the server may have
+    closed while idle, is resent once on a fresh connection straight away.
+    Attempts and their timeouts follow 'retry_policy'.
+    """
+
+    def __init__(self, address, headers=None, retry_policy=None):
+        url = urlparse(address)
+        self.host = url.hostname
+        self.port = url.port
+        self.path = url.path + ('?' + url.query if url.query else '')
+        self.headers = {'Metadata': 'true'}
+        if headers:
+            self.headers = _merge_headers(self.headers, headers)
+        self.retry_policy = retry_policy or retry.HTTP_RETRY_POLICY
+        self.connection = None
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _send(self, method, body, headers, timeout):
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection(
+                self.host, self.port, timeout=timeout)
+        try:
+            self.connection.timeout = timeout
+            if self.connection.sock is not None:
+                self.connection.sock.settimeout(timeout)
+            self.connection.request(method, self.path, body, headers)
+            response = self.connection.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            self.close()
+            raise
+        if response.will_close:
+            self.close()
+        if response.status >= 400:
+            raise ScheduledEventsError(response.status, response.reason, data)
+        return data
+
+    def request(self, method, body=None, headers=None, retry_policy=None):
+        """
+        Send a request and return the response body as bytes.
+        """
+        all_headers = self.headers
+        if headers:
+            all_headers = _merge_headers(self.headers, headers)
+
+        def attempt(timeout):
+            reused = self.connection is not None
+            try:
+                return self._send(method, body, all_headers, timeout)
+            except (http.client.HTTPException, OSError):
+                if not reused:
+                    raise
+            return self._send(method, body, all_headers, timeout)
+
+        policy = retry_policy or self.retry_policy
+        return policy.run(attempt,
+                          retry_on=(http.client.HTTPException, OSError,
+                                    ScheduledEventsError),
+                          giveup=is_permanent_error)
+
+    def get(self, retry_policy=None):
+        """
+        Return the raw scheduled events document.
+        """
+        return self.request('GET', retry_policy=retry_policy)
+
+    def get_document(self, retry_policy=None):
+        """
+        Return the scheduled events document decoded from JSON.
+        """
+        return json.loads(self.get(retry_policy).decode('utf-8'))
+
+    def get_events(self, retry_policy=None):
+        """
+        Return the scheduled events document as a ScheduledEventsDocument.
+        """
+        return ScheduledEventsDocument.from_bytes(self.get(retry_policy))
+
+    def post(self, data, retry_policy=None):
+        """
+        POST 'data', a JSON string or an object to encode as JSON.
+        """
+        if not isinstance(data, str):
+            data = json.dumps(data)
+        return self.request('POST', data.encode('utf-8'),
+                            {'Content-Type': 'application/json'},
+                            retry_policy)
+
+
+def _select_json_loads():
+    """
+    Return the fastest available function decoding JSON from bytes.
+    """
+    try:
+        import orjson
+        return orjson.loads
+    except ImportError:
+        pass
+    try:
+        import ujson
+        return ujson.loads
+    except ImportError:
+        pass
+    return lambda data: json.loads(data.decode('utf-8'))
+
+
+def _select_on_first_use(data):
+    global json_loads
+    json_loads = _select_json_loads()
+    return json_loads(data)
+
+
+# Decodes a response body. Replace with set_json_backend(). The backend is
+# picked on first use so that importing this module does not load it.
+json_loads = _select_on_first_use
+
+
+def set_json_backend(loads):
+    """
+    Use 'loads', a function taking bytes, to decode scheduled events
+    documents.
+    """
+    global json_loads
+    json_loads = loads
+
+
+class EventType(object):
+    FREEZE = 'Freeze'
+    REBOOT = 'Reboot'
+    REDEPLOY = 'Redeploy'
+    PREEMPT = 'Preempt'
+    TERMINATE = 'Terminate'
+
+
+class EventStatus(object):
+    SCHEDULED = 'Scheduled'
+    STARTED = 'Started'
+
+
+class ResourceType(object):
+    VIRTUAL_MACHINE = 'VirtualMachine'
+
+
+# Known field values decode to the constants above so every event shares
+# them; other values are interned.
+_CONSTANTS = dict((value, value) for cls in (EventType, EventStatus,
+                                             ResourceType)
+                  for name, value in vars(cls).items()
+                  if not name.startswith('_'))
+
+
+def _intern(value):
+    if not isinstance(value, str):
+        return value
+    constant = _CONSTANTS.get(value)
+    if constant is None:
+        constant = sys.intern(value)
+    return constant
+
+
+class ScheduledEvent(object):
+    """
+    One entry of the Events array.
+    """
+
+    __slots__ = ('event_id', 'event_type', 'resource_type', 'resources',
+                 'event_status', 'not_before', 'description', 'event_source',
+                 'duration_in_seconds', '_not_before_timestamp')
+
+    def __init__(self, event_id, event_type=None, resource_type=None,
+                 resources=(), event_status=None, not_before='',
+                 description=None, event_source=None,
+                 duration_in_seconds=None):
+        self.event_id = event_id
+        self.event_type = _intern(event_type)
+        self.resource_type = _intern(resource_type)
+        self.resources = tuple(_intern(r) for r in resources or ())
+        self.event_status = _intern(event_status)
+        self.not_before = not_before or ''
+        self.description = description
+        self.event_source = _intern(event_source)
+        self.duration_in_seconds = duration_in_seconds
+        self._not_before_timestamp = False
+
+    @classmethod
+    def from_dict(cls, event):
+        return cls(event['EventId'], event.get('EventType'),
+                   event.get('ResourceType'), event.get('Resources'),
+                   event.get('EventStatus'), event.get('NotBefore'),
+                   event.get('Description'), event.get('EventSource'),
+                   event.get('DurationInSeconds'))
+
+    def to_dict(self):
+        event = {
+            'EventId': self.event_id,
+            'EventType': self.event_type,
+            'ResourceType': self.resource_type,
+            'Resources': list(self.resources),
+            'EventStatus': self.event_status,
+            'NotBefore': self.not_before,
+        }
+        for key, value in (('Description', self.description),
+                           ('EventSource', self.event_source),
+                           ('DurationInSeconds', self.duration_in_seconds)):
+            if value is not None:
+                event[key] = value
+        return event
+
+    @property
+    def not_before_timestamp(self):
+        """
+        NotBefore as a unix timestamp, or None if it is empty (the event
+        has no earliest start time). Parsed on first use.
+        """
+        if self._not_before_timestamp is False:
+            self._not_before_timestamp = parse_not_before(self.not_before)
+        return self._not_before_timestamp
+
+    def __eq__(self, other):
+        if not isinstance(other, ScheduledEvent):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return str(self.to_dict())
+
+
+class ScheduledEventsDocument(object):
+    """
+    A decoded scheduled events document.
+    """
+
+    __slots__ = ('incarnation', 'events')
+
+    def __init__(self, incarnation, events=()):
+        self.incarnation = incarnation
+        self.events = tuple(events)
+
+    @classmethod
+    def from_dict(cls, document):
+        return cls(document['DocumentIncarnation'],
+                   [ScheduledEvent.from_dict(e) for e in document['Events']])
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Decode a response body with the current JSON backend.
+        """
+        return cls.from_dict(json_loads(data))
+
+    def to_dict(self):
+        return {'DocumentIncarnation': self.incarnation,
+                'Events': [e.to_dict() for e in self.events]}
+
+    def __repr__(self):
+        return str(self.to_dict())
+
+
+# Matches the incarnation without decoding the whole document. The endpoint
+# emits DocumentIncarnation ahead of the events; if it is not found the
+# document is decoded as usual.
+_INCARNATION = re.compile(rb'"DocumentIncarnation"\s*:\s*(\d+)')
+
+# Event attributes whose change is reported by DocumentTracker.
+CHANGE_FIELDS = ('event_status', 'not_before')
+
+
+class EventsDelta(object):
+    """
+    Difference between two scheduled events documents.
+
+    added: events with an EventId not seen before.
+    removed: previously seen events that are gone.
+    changed: (old, new) pairs of events whose CHANGE_FIELDS differ.
+    """
+
+    __slots__ = ('incarnation', 'document', 'added', 'removed', 'changed')
+
+    def __init__(self, incarnation, document):
+        self.incarnation = incarnation
+        self.document = document
+        self.added = []
+        self.removed = []
+        self.changed = []
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def __repr__(self):
+        return ("EventsDelta(incarnation={0}, added={1}, removed={2}, "
+                "changed={3})").format(self.incarnation, len(self.added),
+                                       len(self.removed), len(self.changed))
+
+
+class DocumentTracker(object):
+    """
+    Remembers the last scheduled events document, keyed by EventId, and
+    reports what changed in each new one.
+    """
+
+    def __init__(self):
+        self.incarnation = None
+        self.document = None
+        self.events = {}
+
+    def update_from_bytes(self, data):
+        """
+        Like update() for a raw response body. When the incarnation is
+        unchanged the body is not decoded at all.
+        """
+        match = _INCARNATION.search(data)
+        if match is not None and self.incarnation is not None and \
+                int(match.group(1)) == self.incarnation:
+            return None
+        return self.update(ScheduledEventsDocument.from_bytes(data))
+
+    def update(self, document):
+        """
+        Returns None if the DocumentIncarnation of 'document', a
+        ScheduledEventsDocument or decoded JSON, is unchanged, otherwise an
+        EventsDelta against the previous document.
+        """
+        if isinstance(document, dict):
+            document = ScheduledEventsDocument.from_dict(document)
+        incarnation = document.incarnation
+        if incarnation == self.incarnation:
+            return None
+
+        delta = EventsDelta(incarnation, document)
+        previous = self.events
+        current = {}
+        for event in document.events:
+            event_id = event.event_id
+            current[event_id] = event
+            old = previous.get(event_id)
+            if old is None:
+                delta.added.append(event)
+            elif any(getattr(old, f) != getattr(event, f)
+                     for f in CHANGE_FIELDS):
+                delta.changed.append((old, event))
+        for event_id, event in previous.items():
+            if event_id not in current:
+                delta.removed.append(event)
+
+        self.incarnation = incarnation
+        self.document = document
+        self.events = current
+        return delta
+
+
+def parse_not_before(not_before):
+    """
+    Return a NotBefore value as a unix timestamp, or None if it is empty
+    (the event has no earliest start time).
+    """
+    if not not_before:
+        return None
+    import email.utils
+    try:
+        return email.utils.parsedate_to_datetime(not_before).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+class ApprovalPolicy(object):
+    """
+    Decides which scheduled events to approve without asking anyone.
+
+    event_types: EventTypes to approve, e.g. ['Reboot', 'Redeploy'];
+                 None approves every type.
+    resources: only approve events affecting one of these resources;
+               None approves events for any resource.
+    max_slack: only approve events that would start within this many
+               seconds anyway; None approves regardless of NotBefore.
+
+    Only events in the 'Scheduled' state are ever approved.
+    """
+
+    def __init__(self, event_types=None, resources=None, max_slack=None):
+        self.event_types = frozenset(event_types) if event_types else None
+        self.resources = frozenset(resources) if resources else None
+        self.max_slack = max_slack
+
+    def approves(self, event, now=None):
+        if event.event_status != EventStatus.SCHEDULED:
+            return False
+        if self.event_types is not None and \
+                event.event_type not in self.event_types:
+            return False
+        if self.resources is not None and \
+                self.resources.isdisjoint(event.resources):
+            return False
+        if self.max_slack is not None:
+            not_before = event.not_before_timestamp
+            if not_before is not None:
+                if now is None:
+                    now = time.time()
+                if not_before - now > self.max_slack:
+                    return False
+        return True
+
+
+def approve_events(client, incarnation, event_ids):
+    """
+    Approve all 'event_ids' of one document incarnation in a single POST.
+    """
+    data = {
+        "DocumentIncarnation": incarnation,
+        "StartRequests": [{"EventId": event_id} for event_id in event_ids]
+    }
+    client.post(data)
+    return data
+
+
+class PollScheduler(object):
+    """
+    Chooses the delay before the next poll from the current events.
+
+    idle_interval: used while there are no events.
+    active_interval: used while events exist.
+    urgent_interval: used once an event has started or its NotBefore is
+                     within 'urgent_window' seconds.
+    jitter: fraction by which the idle interval is randomized, so hosts that
+            started together do not keep polling in lockstep.
+    max_error_interval: cap of the backoff after failed polls, see
+                        error_interval().
+
+    The active interval is shortened so that polling tightens exactly when
+    the earliest NotBefore enters the urgent window.
+    """
+
+    def __init__(self, idle_interval=15.0, active_interval=5.0,
+                 urgent_interval=1.0, urgent_window=60.0, jitter=0.1,
+                 max_error_interval=60.0):
+        self.idle_interval = idle_interval
+        self.active_interval = active_interval
+        self.urgent_interval = urgent_interval
+        self.urgent_window = urgent_window
+        self.jitter = jitter
+        self.max_error_interval = max_error_interval
+
+    def error_interval(self, failures):
+        """
+        Delay after 'failures' consecutive failed polls: the active interval,
+        doubled for each further failure up to max_error_interval, jittered.
+        """
+        interval = min(self.max_error_interval,
+                       self.active_interval * 2 ** min(failures - 1, 16))
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def next_interval(self, events, now=None):
+        if now is None:
+            now = time.time()
+        earliest = None
+        for event in events:
+            if event.event_status != EventStatus.SCHEDULED:
+                return self.urgent_interval
+            not_before = event.not_before_timestamp
+            if not_before is None:
+                return self.urgent_interval
+            if earliest is None or not_before < earliest:
+                earliest = not_before
+        if earliest is None:
+            return self.idle_interval * random.uniform(1 - self.jitter,
+                                                       1 + self.jitter)
+        until_urgent = earliest - self.urgent_window - now
+        return min(self.active_interval,
+                   max(self.urgent_interval, until_urgent))
+
+
+class ApprovalDaemon(object):
+    """
+    Polls for scheduled events and approves them according to an
+    ApprovalPolicy, sending one POST per decision round.
+
+    Events the policy declines stay pending and are reconsidered every
+    round, so a NotBefore based policy approves them once they get close.
+    """
+
+    def __init__(self, client, policy, scheduler=None):
+        self.client = client
+        self.policy = policy
+        self.scheduler = scheduler or PollScheduler()
+        self.tracker = DocumentTracker()
+        self.pending = {}
+
+    def poll_once(self, now=None):
+        """
+        Run one decision round. Returns the approval sent, or None.
+        """
+        delta = self.tracker.update_from_bytes(self.client.get())
+        if delta is not None:
+            for event in delta.removed:
+                self.pending.pop(event.event_id, None)
+            for event in delta.added:
+                self.pending[event.event_id] = event
+            for _, event in delta.changed:
+                self.pending[event.event_id] = event
+
+        approved = [event_id for event_id, event in self.pending.items()
+                    if self.policy.approves(event, now)]
+        if not approved:
+            return None
+        data = approve_events(self.client, self.tracker.incarnation, approved)
+        for event_id in approved:
+            del self.pending[event_id]
+        return data
+
+    def run(self):
+        """
+        Poll forever, at the cadence chosen by the scheduler. Failed
+        requests and malformed documents are reported and polling backs off
+        until a round succeeds again.
+        """
+        failures = 0
+        while True:
+            try:
+                data = self.poll_once()
+                if data is not None:
+                    print("Approved with the following:\n" + str(data))
+                failures = 0
+            except (OSError, http.client.HTTPException,
+                    ScheduledEventsError) as e:
+                failures += 1
+                print("Scheduled events request failed: {0}".format(e))
+            except (KeyError, TypeError, ValueError) as e:
+                failures += 1
+                print("Malformed scheduled events document: {0!r}".format(e))
+            if failures:
+                interval = self.scheduler.error_interval(failures)
+            else:
+                interval = self.scheduler.next_interval(
+                    self.tracker.events.values())
+            time.sleep(interval)
@@ -16,10 +16,11 @@ Press Ctrl + C and then Enter to exit.
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-import json
 import argparse
 
-from util import get_address, get_scheduled_events, post_scheduled_events
+from scheduled_events import (ApprovalDaemon, ApprovalPolicy, DocumentTracker,
+                              PollScheduler, ScheduledEventsClient)
+from address import get_address
 
 def parse_args():
     '''
@@ -30,6 +31,20 @@ def parse_args():
                         help="Get the IP address from Windows registry.")
     parser.add_argument('--ip_address', type=str,
                         help="The IP address of scheduled events endpoint.")
+    parser.add_argument('--discover', action="store_true",
+                        help="Also run DHCP endpoint discovery while resolving the address.")
+    parser.add_argument('--daemon', action="store_true",
+                        help="Run unattended, approving events by policy.")
+    parser.add_argument('--approve_types', type=str,
+                        help="Comma separated EventTypes to approve in daemon mode.")
+    parser.add_argument('--approve_resources', type=str,
+                        help="Comma separated resources to approve events for in daemon mode.")
+    parser.add_argument('--approve_within', type=float,
+                        help="Only approve events due to start within this many seconds.")
+    parser.add_argument('--idle_interval', type=float, default=15.0,
+                        help="Seconds between polls in daemon mode while there are no events.")
+    parser.add_argument('--active_interval', type=float, default=5.0,
+                        help="Seconds between polls in daemon mode while events are pending.")
     return parser.parse_args()
 
 def main():
@@ -39,33 +54,50 @@ def main():
     args = parse_args()
     headers = {'metadata':'true'}
 
-    address = get_address(args.ip_address, args.use_registry, headers)
+    address = get_address(args.ip_address, args.use_registry, headers, args.discover)
 
     print("Scheduled Events endpoint address = " + address)
 
+    # The polling loop and approvals share one persistent connection.
+    client = ScheduledEventsClient(address, headers)
+
+    if args.daemon:
+        policy = ApprovalPolicy(
+            args.approve_types.split(',') if args.approve_types else None,
+            args.approve_resources.split(',') if args.approve_resources else None,
+            args.approve_within)
+        scheduler = PollScheduler(args.idle_interval, args.active_interval)
+        ApprovalDaemon(client, policy, scheduler).run()
+
+    tracker = DocumentTracker()
+
     # Repeat until user terminates the script.
     while True:
         # Send a GET request for scheduled events and read the response.
-        response = get_scheduled_events(address, headers)
-        document = json.loads(response.read().decode('utf-8'))
-        events = document['Events']
+        # Nothing to do unless the DocumentIncarnation changed.
+        delta = tracker.update_from_bytes(client.get())
+        if delta is None:
+            input("Press Enter to continue.")
+            continue
+        document = delta.document
         print('Scheduled Events Document:\n' + str(document))
 
-        # Go through each event in the response and prompt user for approval.
+        # Go through each new or changed event and prompt user for approval.
+        events = delta.added + [new for _, new in delta.changed]
         for event in events:
             print("Current Event:\n" + str(event))
             approved = input("Approve event? (y / n): ")
             if approved.lower() == 'y':
                 data = {
-                    "DocumentIncarnation": document["DocumentIncarnation"],
+                    "DocumentIncarnation": document.incarnation,
                     "StartRequests": [{
-                        "EventId": event["EventId"]
+                        "EventId": event.event_id
                     }]
                 }
                 print("Approving with the following:\n" + str(data))
 
                 # Send a POST request to expedite.
-                post_scheduled_events(address, json.dumps(data), headers)
+                client.post(data)
         input("Press Enter to continue.")
 
 if __name__ == '__main__':